@@ -16,27 +16,59 @@
     license folder.
 """
 
-import os, sys
+import os, sys, getopt, time
 sys.path.append('..')
 sys.path.append('.')
-from gditools import CdImage, _copy_buffered
+from gditools import CdImage, _copy_buffered, _throughput
 
 
-def bin2iso(ifile, ofile='{dirname}/{basename}.iso', length = None):
+def bin2iso(ifile, ofile='{dirname}/{basename}.iso', length = None,
+            chunk_sectors = 512):
+    """
+    chunk_sectors: Number of sectors converted per batch, the whole
+                   batch is de-interleaved and written in one go.
+    """
+    if int(chunk_sectors) < 1:
+        raise ValueError('Argument chunk_sectors should be at least 1')
     binfile = CdImage(ifile, mode = 2352)
     ofile = ofile.format(dirname = os.path.dirname(ifile),
                          basename = os.path.splitext(os.path.basename(ifile))[0])
     print('Reading: {} \nWriting: {}'.format(ifile, ofile))
+    start = time.time()
     with open(ofile, 'wb') as of:
-        _copy_buffered(binfile, of, length=length)
+        written = _copy_buffered(binfile, of, length=length,
+                                 bufsize=int(chunk_sectors)*2048)
+    binfile.close()
+    print('Converted {}'.format(_throughput(written, time.time() - start)))
+
+def _printUsage(pname='bin2iso.py'):
+    print('bin2iso, converts a bin file into an iso, BLINDLY.\n')
+    print('Usage: bin2iso.py [--chunk-sectors num] file.bin [file.iso]')
+    print('\n  --chunk-sectors [num]  Sectors converted per batch. Default: 512')
+    print('\nFamilyGuy 2014')
 
 def main(argv):
-    if len(argv) > 1 and os.path.isfile(argv[1]):
-        bin2iso(*argv[1:])
+    try:
+        opts, args = getopt.gnu_getopt(argv[1:], '', ['chunk-sectors='])
+    except getopt.GetoptError as e:
+        print('{}\n'.format(e))
+        _printUsage(argv[0])
+        sys.exit(2)
+
+    kwargs = {}
+    for opt, arg in opts:
+        if opt == '--chunk-sectors':
+            if not arg.isdigit() or int(arg) < 1:
+                print('{} should be a number of sectors, at least 1\n'
+                      .format(opt))
+                _printUsage(argv[0])
+                sys.exit(2)
+            kwargs['chunk_sectors'] = int(arg)
+
+    if len(args) > 0 and os.path.isfile(args[0]):
+        bin2iso(*args, **kwargs)
     else:
-        print('bin2iso, converts a bin file into an iso, BLINDLY.\n')
-        print('Usage: bin2iso.py file.bin [file.iso]')
-        print('\nFamilyGuy 2014')
+        _printUsage(argv[0])
 
 if __name__ == '__main__':
     main(sys.argv)
@@ -0,0 +1,218 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    gdibatch, applies the same gditools actions to many gdi dumps at
+    once, several dumps being processed in parallel.
+
+    This is an example of a simple program that uses gditools.py as a
+    base library to handle gdi files in a meaningful manner.
+
+    gdibatch.py is released under the GNU General Public License
+    (version 3), a copy of which (GNU_GPL_v3.txt) is provided in the
+    license folder.
+"""
+
+import os, sys, getopt, glob, time, traceback, multiprocessing
+sys.path.append('..')
+sys.path.append('.')
+from gditools import GDIfile
+
+
+def find_gdis(paths):
+    """
+    Returns the sorted gdi files found in paths, which can be gdi files,
+    glob patterns or folders that are searched recursively.
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                found += [os.path.join(root, i) for i in files
+                          if i.lower().endswith('.gdi')]
+        elif os.path.isfile(path):
+            found.append(path)
+        else:
+            found += glob.glob(path)
+
+    gdis, seen = [], set()
+    for i in sorted(found):
+        if not os.path.realpath(i) in seen:
+            seen.add(os.path.realpath(i))
+            gdis.append(i)
+    return gdis
+
+
+def output_folders(gdis, outputpath = ''):
+    """
+    Returns where the outputs of each gdi go: its own folder, or a
+    subfolder of outputpath named like it. Folders sharing a name get
+    their path from where they part instead, and gdis of one folder a
+    subfolder named like them.
+    """
+    if not outputpath:
+        return [os.path.dirname(os.path.realpath(i)) for i in gdis]
+
+    dirs = [os.path.dirname(os.path.realpath(i)) for i in gdis]
+    names = [os.path.basename(i) for i in dirs]
+    for name in set(names):
+        same = [i for i, j in enumerate(names) if j == name]
+        if len(same) > 1:
+            # e.g. /a/x/game & /b/game -> a/x/game & b/game
+            common = os.path.commonprefix([dirs[i] + os.sep for i in same])
+            common = common[:common.rfind(os.sep) + 1]
+            for i in same:
+                names[i] = dirs[i][len(common):] or name
+    for name in set(names):
+        same = [i for i, j in enumerate(names) if j == name]
+        if len(same) > 1:
+            for i in same:
+                names[i] = os.path.join(name, os.path.splitext(
+                                        os.path.basename(gdis[i]))[0])
+    return [os.path.join(os.path.abspath(outputpath), i) for i in names]
+
+
+def process_gdi(job):
+    """
+    Applies the actions to one gdi file. Never raises, errors are
+    returned so one bad dump doesn't stop the others.
+
+    Returns (gdi filename, error or None, listing, seconds)
+    """
+    gdi, outdir, actions = job
+    start = time.time()
+    listing = ''
+    try:
+        with GDIfile(gdi, cache = actions['cache']) as gdifile:
+            gdifile._dirname = outdir
+            if not os.path.exists(outdir):
+                os.makedirs(outdir)
+
+            datafolder = actions['datafolder']
+            if datafolder == '__volume_label__':
+                datafolder = gdifile.get_volume_label()
+
+            if actions['list']:
+                listing = '\n'.join(gdifile.tree())
+
+            if actions['sorttxt']:
+                gdifile.dump_sorttxt(filename = actions['sorttxt'],
+                                     prefix = datafolder)
+
+            if actions['bootsector']:
+                gdifile.dump_bootsector(filename = actions['bootsector'])
+
+            if actions['extract']:
+                gdifile.dump_all_files(target = datafolder)
+
+    except Exception:
+        error = traceback.format_exc().strip().split('\n')[-1]
+        return gdi, error, listing, time.time() - start
+
+    return gdi, None, listing, time.time() - start
+
+
+def gdibatch(gdis, outputpath = '', jobs = None, **actions):
+    """
+    Processes gdis with a pool of jobs processes, reporting each one as
+    it's done. Returns the list of (gdi filename, error) that failed.
+
+    actions: list, sorttxt, bootsector, extract, datafolder & cache,
+             like the options of gditools.py
+    """
+    defaults = dict(list = False, sorttxt = '', bootsector = '',
+                    extract = False, datafolder = 'data', cache = False)
+    defaults.update(actions)
+    outdirs = output_folders(gdis, outputpath)
+    todo = [(i, j, defaults) for i, j in zip(gdis, outdirs)]
+
+    failed = []
+    pool = multiprocessing.Pool(jobs or multiprocessing.cpu_count())
+    try:
+        results = pool.imap_unordered(process_gdi, todo)
+        for n, (gdi, error, listing, seconds) in enumerate(results):
+            status = 'FAILED' if error else 'OK'
+            print('[{}/{}] {:6} {}    ({:.2f} s)'.format(n + 1, len(todo),
+                                                          status, gdi,
+                                                          seconds))
+            if listing:
+                print(listing + '\n')
+            if error:
+                print('         {}'.format(error))
+                failed.append((gdi, error))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    print('\n{} gdi files processed, {} failed.'.format(len(todo),
+                                                        len(failed)))
+    for gdi, error in failed:
+        print('  {}: {}'.format(gdi, error))
+    return failed
+
+
+def _printUsage(pname='gdibatch.py'):
+    print('gdibatch, applies gditools actions to many gdi dumps\n')
+    print('Usage: {} [options] path [path ...]\n'.format(pname))
+    print('  path                   A gdi file, a glob pattern or a folder')
+    print('                           searched recursively for gdi files')
+    print('  -h, --help             Display this help')
+    print('  -l, --list             List all files of each gdi')
+    print('  -o [outdir]            Output directory. Default: gdi folders')
+    print('                           (each gdi gets a subfolder named like')
+    print('                            the folder it is in)')
+    print('  -s [filename]          Create a sorttxt file with custom name')
+    print('  -b [ipname]            Dump the ip.bin with custom name')
+    print('  --extract-all          Dump all the files in the *data-folder*')
+    print('  --data-folder [name]   *data-folder* subfolder. Default: data')
+    print(' '*27 + '(__volume_label__ --> Use ISO9660 volume label)')
+    print('  -j, --jobs [num]       gdi files processed at once. Default: CPUs')
+    print('  --cache                Keep the parsed filesystems next to the gdis')
+
+
+def main(argv):
+    try:
+        opts, args = getopt.gnu_getopt(argv[1:], 'hlo:s:b:j:',
+                                       ['help', 'list', 'extract-all',
+                                        'data-folder=', 'jobs=', 'cache'])
+    except getopt.GetoptError:
+        _printUsage(argv[0])
+        sys.exit(2)
+
+    outputpath = ''
+    jobs = None
+    actions = {}
+    for opt, arg in opts:
+        if opt in ['-h', '--help']:
+            _printUsage(argv[0])
+            sys.exit()
+        elif opt in ['-l', '--list']:
+            actions['list'] = True
+        elif opt == '-o':
+            outputpath = arg
+        elif opt == '-s':
+            actions['sorttxt'] = arg
+        elif opt == '-b':
+            actions['bootsector'] = arg
+        elif opt == '--extract-all':
+            actions['extract'] = True
+        elif opt == '--data-folder':
+            actions['datafolder'] = arg
+        elif opt in ['-j', '--jobs']:
+            jobs = int(arg)
+        elif opt == '--cache':
+            actions['cache'] = True
+
+    gdis = find_gdis(args)
+    if not gdis:
+        _printUsage(argv[0])
+        sys.exit()
+
+    if gdibatch(gdis, outputpath, jobs, **actions):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv)
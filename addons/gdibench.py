@@ -0,0 +1,259 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    gdibench, times gditools on gdi dumps: opening, listing, sorttxt,
+    extraction, bin2iso and gdifix. Results are written as JSON so the
+    runs of two revisions can be compared.
+
+    Without gdi files, it runs on a standard set of synthetic images
+    written by gdisynth the first time.
+
+    This is an example of a simple program that uses gditools.py as a
+    base library to handle gdi files in a meaningful manner.
+
+    gdibench.py is released under the GNU General Public License
+    (version 3), a copy of which (GNU_GPL_v3.txt) is provided in the
+    license folder.
+"""
+
+import os, sys, getopt, time, json, shutil, tempfile, platform
+sys.path.append('..')
+sys.path.append('.')
+from gditools import GDIfile, parse_gdi
+from bin2iso import bin2iso
+from gdifix import gdifix
+from gdisynth import build_gdi, random_tree
+
+
+# name, random_tree kwargs, build_gdi kwargs
+IMAGES = [
+    ('raw-3track', dict(files = 300, sizes = 'mixed'), dict()),
+    ('iso-3track', dict(files = 300, sizes = 'mixed'), dict(raw = False)),
+    ('raw-multitrack', dict(files = 300, sizes = 'mixed'), dict(tracks = 6)),
+    ('large-files', dict(files = 8, sizes = 'large'), dict()),
+    ('wide-tree', dict(files = 10000, depth = 1, width = 64,
+                       sizes = 'tiny'), dict(raw = False)),
+    ('deep-tree', dict(files = 3000, depth = 8, width = 3,
+                       sizes = 'tiny'), dict()),
+]
+
+BENCHMARKS = ['open', 'gen_records', 'get_sorttxt', 'dump_all_files',
+              'bin2iso', 'gdifix']
+
+
+class _Quiet(object):
+    # Silences what the timed code prints
+    def __enter__(self):
+        self._stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, type=None, value=None, traceback=None):
+        sys.stdout.close()
+        sys.stdout = self._stdout
+
+
+def _log(text):
+    # Progress goes to stderr, stdout being kept for the results
+    sys.stderr.write(text + '\n')
+    sys.stderr.flush()
+
+
+def standard_images(folder):
+    """
+    Returns {name: gdi filename} of the standard images in folder,
+    writing those that are missing.
+    """
+    ret = {}
+    for name, tree_kwargs, build_kwargs in IMAGES:
+        gdi = os.path.join(folder, name, 'disc.gdi')
+        if not os.path.isfile(gdi):
+            _log('Writing {}'.format(gdi))
+            build_gdi(os.path.dirname(gdi), random_tree(**tree_kwargs),
+                      **build_kwargs)
+        ret[name] = gdi
+    return ret
+
+
+def _time(setup, func, cleanup = None):
+    # Only func is timed, it gets what setup returns
+    arg = setup()
+    try:
+        start = time.time()
+        with _Quiet():
+            func(arg)
+        return time.time() - start
+    finally:
+        if cleanup:
+            cleanup(arg)
+
+
+def run_benchmark(name, gdi, tmpdir):
+    """
+    Runs benchmark name once on gdi, returns the seconds it took or
+    None if it doesn't apply (bin2iso of a 2048 bytes/sector track).
+    """
+    opened = lambda: GDIfile(gdi)
+    close = lambda g: g.__exit__()
+    output = os.path.join(tmpdir, 'output')
+    def remove(arg = None):
+        if os.path.isdir(output):
+            shutil.rmtree(output)
+        elif os.path.exists(output):
+            os.remove(output)
+
+    if name == 'open':
+        return _time(lambda: None, lambda arg: GDIfile(gdi).__exit__())
+    elif name == 'gen_records':
+        return _time(opened, lambda g: list(g.gen_records()), close)
+    elif name == 'get_sorttxt':
+        return _time(opened, lambda g: g.get_sorttxt(), close)
+    elif name == 'dump_all_files':
+        return _time(opened, lambda g: g.dump_all_files(target = output),
+                     lambda g: (close(g), remove()))
+    elif name == 'bin2iso':
+        track = parse_gdi(gdi)[-1]     # The one holding the files
+        if track['mode'] != 2352:
+            return None
+        return _time(lambda: None,
+                     lambda arg: bin2iso(track['filename'], output), remove)
+    elif name == 'gdifix':
+        return _time(lambda: None, lambda arg: gdifix(gdi, output), remove)
+    raise ValueError('Unknown benchmark: {}'.format(name))
+
+
+def gdibench(gdis, benchmarks = BENCHMARKS, repeat = 3, label = ''):
+    """
+    Times benchmarks repeat times on every gdi of gdis, {name: gdi}.
+
+    Returns the results, ready to be dumped as JSON:
+        {'label': label, 'python': ..., 'platform': ..., 'repeat': ...,
+         'results': {gdi name: {benchmark: {'runs': [seconds, ...],
+                                            'min': ..., 'median': ...}}}}
+    """
+    tmpdir = tempfile.mkdtemp(prefix = 'gdibench')
+    results = {}
+    try:
+        for image in sorted(gdis):
+            results[image] = {}
+            for name in benchmarks:
+                runs = []
+                for i in range(repeat):
+                    seconds = run_benchmark(name, gdis[image], tmpdir)
+                    if seconds is None:
+                        break
+                    runs.append(seconds)
+                if runs:
+                    ordered = sorted(runs)
+                    results[image][name] = dict(runs = runs, min = ordered[0],
+                                                median = ordered[len(runs)/2])
+                    _log('{:16} {:16} {:.4f} s'.format(image, name,
+                                                       ordered[0]))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return dict(label = label, python = platform.python_version(),
+                platform = platform.platform(), repeat = repeat,
+                results = results)
+
+
+def compare(old, new, threshold = 0.1):
+    """
+    Returns the lines of a report comparing the best times of two
+    results of gdibench, flagging changes over threshold (10%).
+    """
+    lines = ['{:16} {:16} {:>10} {:>10} {:>7}'.format('image', 'benchmark',
+                                                     old['label'] or 'old',
+                                                     new['label'] or 'new',
+                                                     'ratio')]
+    for image in sorted(new['results']):
+        for name in BENCHMARKS:
+            try:
+                a = old['results'][image][name]['min']
+                b = new['results'][image][name]['min']
+            except KeyError:
+                continue
+            ratio = b / a if a else float('inf')
+            flag = ''
+            if ratio > 1 + threshold:
+                flag = '  slower'
+            elif ratio < 1 - threshold:
+                flag = '  faster'
+            lines.append('{:16} {:16} {:10.4f} {:10.4f} {:7.2f}{}'.format(
+                            image, name, a, b, ratio, flag))
+    return lines
+
+
+def _printUsage(pname='gdibench.py'):
+    print('gdibench, times gditools on gdi dumps\n')
+    print('Usage: {} [options] [disc.gdi ...]\n'.format(pname))
+    print('  -h, --help             Display this help')
+    print('  -o [filename]          Write the JSON results there. Default: stdout')
+    print('  --images [folder]      Standard synthetic images, written if missing,')
+    print('                           used without gdi. Default: bench_images')
+    print('  --repeat [num]         Runs of each benchmark, the best one counts.')
+    print('                           Default: 3')
+    print('  --only [names]         Comma separated benchmarks among:')
+    print('                           ' + ', '.join(BENCHMARKS))
+    print('  --label [text]         Name of this run, e.g. a revision')
+    print('  --compare [filename]   Compare with the JSON results of another run')
+
+
+def main(argv):
+    try:
+        opts, args = getopt.gnu_getopt(argv[1:], 'ho:',
+                                       ['help', 'images=', 'repeat=', 'only=',
+                                        'label=', 'compare='])
+    except getopt.GetoptError:
+        _printUsage(argv[0])
+        sys.exit(2)
+
+    output = ''
+    images = 'bench_images'
+    kwargs = {}
+    old = None
+    for opt, arg in opts:
+        if opt in ['-h', '--help']:
+            _printUsage(argv[0])
+            sys.exit()
+        elif opt == '-o':
+            output = arg
+        elif opt == '--images':
+            images = arg
+        elif opt == '--repeat':
+            kwargs['repeat'] = int(arg)
+        elif opt == '--only':
+            kwargs['benchmarks'] = [i for i in arg.split(',') if i]
+            for i in kwargs['benchmarks']:
+                if not i in BENCHMARKS:
+                    _printUsage(argv[0])
+                    sys.exit(2)
+        elif opt == '--label':
+            kwargs['label'] = arg
+        elif opt == '--compare':
+            with open(arg) as f:
+                old = json.load(f)
+
+    if args:
+        # Named after their folders, unless some share a name
+        paths = [os.path.abspath(i) for i in args]
+        names = [os.path.basename(os.path.dirname(i)) for i in paths]
+        if len(set(names)) < len(names):
+            names = paths
+        gdis = dict(zip(names, paths))
+    else:
+        gdis = standard_images(images)
+
+    results = gdibench(gdis, **kwargs)
+    text = json.dumps(results, indent = 2, sort_keys = True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if old:
+        _log('\n' + '\n'.join(compare(old, results)))
+
+if __name__ == '__main__':
+    main(sys.argv)
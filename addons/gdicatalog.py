@@ -0,0 +1,328 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    gdicatalog, keeps a SQLite catalog of the filesystems of many gdi
+    dumps: their PVD, the header of their IP.BIN and every record with
+    its path, LBA, size and date. Dumps are cataloged in parallel and
+    only again once their tracks changed, then the catalog can be
+    queried without opening any of them.
+
+    This is an example of a simple program that uses gditools.py as a
+    base library to handle gdi files in a meaningful manner.
+
+    gdicatalog.py is released under the GNU General Public License
+    (version 3), a copy of which (GNU_GPL_v3.txt) is provided in the
+    license folder.
+"""
+
+import os, sys, getopt, time, traceback, sqlite3, multiprocessing
+sys.path.append('..')
+sys.path.append('.')
+from gditools import GDIfile, parse_gdi
+from gdibatch import find_gdis
+
+
+# Fields of get_pvd kept in the catalog, as pvd_<field>
+PVD_FIELDS = ('system_identifier', 'volume_identifier', 'volume_set_identifer',
+              'publisher_identifier', 'data_preparer_identifier',
+              'application_identifier', 'copyright_file_identifier',
+              'abstract_file_identifier', 'bibliographic_file_identifier',
+              'volume_datetime_created', 'volume_datetime_modified',
+              'volume_space_size', 'logical_block_size')
+
+# Header of the IP.BIN: (field, offset, length), kept as ip_<field>
+IP_FIELDS = (('hardware_id', 0x00, 16), ('maker_id', 0x10, 16),
+             ('device_info', 0x20, 16), ('area_symbols', 0x30, 8),
+             ('peripherals', 0x38, 8), ('product_number', 0x40, 10),
+             ('product_version', 0x4a, 6), ('release_date', 0x50, 16),
+             ('boot_filename', 0x60, 16), ('software_maker', 0x70, 16),
+             ('title', 0x80, 128))
+
+FILE_FIELDS = ('path', 'name', 'lba', 'size', 'flags', 'timestamp', 'date',
+               'track')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    gdi TEXT UNIQUE NOT NULL,
+    identity TEXT NOT NULL,
+    cataloged REAL NOT NULL,
+    {});
+CREATE TABLE IF NOT EXISTS files (
+    image INTEGER NOT NULL REFERENCES images(id),
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    lba INTEGER,
+    size INTEGER,
+    flags INTEGER,
+    timestamp INTEGER,
+    date TEXT,
+    track TEXT);
+CREATE INDEX IF NOT EXISTS files_image ON files(image);
+CREATE INDEX IF NOT EXISTS files_name ON files(name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS files_size ON files(size);
+""".format(',\n    '.join(['pvd_{}'.format(i) for i in PVD_FIELDS] +
+                          ['ip_{} TEXT'.format(i[0]) for i in IP_FIELDS]))
+
+
+def _text(value):
+    # Strings of the discs are bytes, latin-1 never fails to decode them
+    return value.decode('latin-1') if isinstance(value, str) else value
+
+
+def open_catalog(filename):
+    """
+    Returns a sqlite3 connection to the catalog filename, created if
+    it doesn't exist.
+    """
+    conn = sqlite3.connect(filename)
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def image_identity(gdi):
+    """
+    Returns what identifies the content of gdi: the size and mtime of
+    the gdi and of its data tracks. It changes when any of them does.
+    """
+    files = [gdi] + [i['filename'] for i in parse_gdi(gdi)]
+    return repr([(os.path.basename(i), os.path.getsize(i),
+                  int(os.path.getmtime(i))) for i in files])
+
+
+def ip_header(bootsector):
+    """
+    Returns the fields of IP_FIELDS of the bootsector, as a dict.
+    """
+    return dict((name, bootsector[offset:offset + length].strip(' \x00'))
+                for name, offset, length in IP_FIELDS)
+
+
+def catalog_image(gdi):
+    """
+    Reads what the catalog keeps of gdi. Returns (identity, {image
+    column: value}, [file row, ...]), file rows being tuples of
+    FILE_FIELDS.
+    """
+    identity = image_identity(gdi)
+    with GDIfile(gdi, verbose = False) as gdifile:
+        pvd = gdifile.get_pvd()
+        image = dict(('pvd_' + i, pvd.get(i)) for i in PVD_FIELDS)
+        for name, value in ip_header(gdifile.get_bootsector()).items():
+            image['ip_' + name] = value
+        rows = [(i['name'], i['name'].split('/')[-1], i['ex_loc'],
+                 i['ex_len'], i['flags'], i['timestamp'], i['date'],
+                 i['track']) for i in gdifile.gen_listing()]
+    return identity, image, rows
+
+
+def _catalog_job(gdi):
+    # Never raises, errors are returned so one bad dump doesn't stop the
+    # others. Returns (gdi, error or None, catalog_image(gdi), seconds)
+    start = time.time()
+    try:
+        return gdi, None, catalog_image(gdi), time.time() - start
+    except Exception:
+        error = traceback.format_exc().strip().split('\n')[-1]
+        return gdi, error, None, time.time() - start
+
+
+def _store_image(conn, gdi, identity, image, rows):
+    # Replaces what the catalog had of gdi, in one transaction
+    columns = ['gdi', 'identity', 'cataloged'] + sorted(image)
+    values = [gdi, identity, time.time()] + [image[i] for i in columns[3:]]
+    with conn:
+        conn.execute('DELETE FROM files WHERE image IN '
+                     '(SELECT id FROM images WHERE gdi = ?)', (gdi,))
+        conn.execute('DELETE FROM images WHERE gdi = ?', (gdi,))
+        cur = conn.execute('INSERT INTO images ({}) VALUES ({})'.format(
+                           ', '.join(columns), ', '.join('?'*len(columns))),
+                           [_text(i) for i in values])
+        conn.executemany('INSERT INTO files VALUES ({})'.format(
+                         ', '.join('?'*(len(FILE_FIELDS) + 1))),
+                         ([cur.lastrowid] + [_text(j) for j in i]
+                          for i in rows))
+
+
+def remove_image(conn, gdi):
+    with conn:
+        conn.execute('DELETE FROM files WHERE image IN '
+                     '(SELECT id FROM images WHERE gdi = ?)', (gdi,))
+        conn.execute('DELETE FROM images WHERE gdi = ?', (gdi,))
+
+
+def update_catalog(conn, gdis, jobs = None, force = False, prune = False):
+    """
+    Catalogs gdis with a pool of jobs processes, skipping those whose
+    identity didn't change since they were cataloged unless force.
+    Only this process writes to the catalog conn.
+
+    prune: Also forget the cataloged gdis that don't exist anymore
+
+    Returns the list of (gdi filename, error) that failed.
+    """
+    known = dict(conn.execute('SELECT gdi, identity FROM images'))
+    if prune:
+        for gdi in known:
+            if not os.path.isfile(gdi):
+                print('Removed {}'.format(gdi))
+                remove_image(conn, gdi)
+
+    todo = []
+    for gdi in [os.path.realpath(i) for i in gdis]:
+        try:
+            if force or known.get(gdi) != image_identity(gdi):
+                todo.append(gdi)
+        except EnvironmentError:
+            todo.append(gdi)    # Its job reports the error
+    print('{} gdi files up to date, {} to catalog.'.format(
+          len(gdis) - len(todo), len(todo)))
+
+    failed = []
+    if not todo:
+        return failed
+    pool = multiprocessing.Pool(jobs or multiprocessing.cpu_count())
+    try:
+        results = pool.imap_unordered(_catalog_job, todo)
+        for n, (gdi, error, result, seconds) in enumerate(results):
+            if error:
+                failed.append((gdi, error))
+            else:
+                _store_image(conn, gdi, *result)
+            print('[{}/{}] {:6} {}    ({:.2f} s)'.format(
+                  n + 1, len(todo), 'FAILED' if error else 'OK', gdi,
+                  seconds))
+            if error:
+                print('         {}'.format(error))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return failed
+
+
+def _like(pattern):
+    # A glob pattern (*, ?) as a LIKE one, escaping with \
+    pattern = pattern.replace('\\', '\\\\').replace('%', '\\%')
+    return pattern.replace('_', '\\_').replace('*', '%').replace('?', '_')
+
+
+def query_files(conn, name = None, path = None, size = None,
+                files_only = True):
+    """
+    Yields the cataloged records matching all the criteria given, as
+    (gdi, path, lba, size, date) ordered by gdi and path.
+
+    name, path: Glob patterns (*, ?) on the name or the full path of
+                the records, case insensitive
+    size: Size in bytes
+    files_only: Skip the directories
+    """
+    where, args = [], []
+    if name is not None:
+        where.append("files.name LIKE ? ESCAPE '\\'")
+        args.append(_like(name))
+    if path is not None:
+        where.append("files.path LIKE ? ESCAPE '\\'")
+        args.append(_like(path))
+    if size is not None:
+        where.append('files.size = ?')
+        args.append(int(size))
+    if files_only:
+        where.append('files.flags & 2 = 0')
+    sql = ('SELECT images.gdi, files.path, files.lba, files.size, files.date '
+           'FROM files JOIN images ON files.image = images.id')
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    return conn.execute(sql + ' ORDER BY images.gdi, files.path', args)
+
+
+def _printUsage(pname='gdicatalog.py'):
+    print('gdicatalog, SQLite catalog of the filesystems of gdi dumps\n')
+    print('Usage: {} [options] update path [path ...]'.format(pname))
+    print('       {} [options] query [query options]\n'.format(pname))
+    print('  path                   A gdi file, a glob pattern or a folder')
+    print('                           searched recursively for gdi files')
+    print('  -h, --help             Display this help')
+    print('  -d [filename]          Catalog database. Default: gdicatalog.db')
+    print('\nupdate options:')
+    print('  -j, --jobs [num]       gdi files processed at once. Default: CPUs')
+    print('  --force                Catalog again the gdi files that did not change')
+    print('  --prune                Forget the gdi files that no longer exist')
+    print('\nquery options, records matching all of them are listed:')
+    print('  --name [pattern]       Name of the record, * and ? as wildcards')
+    print('  --path [pattern]       Full path of the record, same wildcards')
+    print('  --size [bytes]         Size of the record')
+    print('  --dirs                 Include the directories')
+    print('  --images               List the cataloged gdi files instead')
+    print('  --sql [query]          Run an SQL query on the images and files')
+    print('                           tables and print its rows')
+
+
+def main(argv):
+    try:
+        opts, args = getopt.gnu_getopt(argv[1:], 'hd:j:',
+                                       ['help', 'jobs=', 'force', 'prune',
+                                        'name=', 'path=', 'size=', 'dirs',
+                                        'images', 'sql='])
+    except getopt.GetoptError:
+        _printUsage(argv[0])
+        sys.exit(2)
+
+    database = 'gdicatalog.db'
+    update = dict()
+    query = dict()
+    images, sql = False, None
+    for opt, arg in opts:
+        if opt in ['-h', '--help']:
+            _printUsage(argv[0])
+            sys.exit()
+        elif opt == '-d':
+            database = arg
+        elif opt in ['-j', '--jobs']:
+            update['jobs'] = int(arg)
+        elif opt == '--force':
+            update['force'] = True
+        elif opt == '--prune':
+            update['prune'] = True
+        elif opt in ['--name', '--path']:
+            query[opt[2:]] = arg
+        elif opt == '--size':
+            query['size'] = int(arg)
+        elif opt == '--dirs':
+            query['files_only'] = False
+        elif opt == '--images':
+            images = True
+        elif opt == '--sql':
+            sql = arg
+
+    if not args or not args[0] in ['update', 'query']:
+        _printUsage(argv[0])
+        sys.exit(2)
+
+    conn = open_catalog(database)
+    try:
+        if args[0] == 'update':
+            gdis = find_gdis(args[1:])
+            if not gdis and not update.get('prune'):
+                _printUsage(argv[0])
+                sys.exit()
+            if update_catalog(conn, gdis, **update):
+                sys.exit(1)
+        elif images:
+            for row in conn.execute('SELECT gdi, pvd_volume_identifier, '
+                                    'ip_product_number, ip_title FROM images '
+                                    'ORDER BY gdi'):
+                print('\t'.join(unicode(i) for i in row).encode('utf-8'))
+        else:
+            rows = conn.execute(sql) if sql else query_files(conn, **query)
+            for row in rows:
+                print('\t'.join(unicode(i) for i in row).encode('utf-8'))
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main(sys.argv)
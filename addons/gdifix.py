@@ -15,27 +15,95 @@
     license folder.
 """
 
-import os, sys
+import os, sys, getopt, time
 sys.path.append('..')
 sys.path.append('.')
-from gditools import GDIfile, _copy_buffered
+from gditools import GDIfile, _copy_buffered, _copy_physical, _throughput
 
 
-def gdifix(ifile, ofile='{dirname}/fixed.iso'):
+def gdifix(ifile, ofile='{dirname}/fixed.iso', chunk_sectors = 512,
+           sparse = True):
+    """
+    chunk_sectors: Number of sectors converted per batch, the whole
+                   batch is de-interleaved and written in one go.
+    sparse: The padding of the image (before track03 and the last 
+            track) is skipped rather than written, leaving holes in
+            ofile where the filesystem supports them. It reads back 
+            as the same 0x00 bytes.
+    """
+    if int(chunk_sectors) < 1:
+        raise ValueError('Argument chunk_sectors should be at least 1')
     gdifile = GDIfile(ifile, verbose = True)._gdifile
     gdifile.seek(0,0)
     ofile = ofile.format(dirname = os.path.dirname(ifile))
     print('Reading: {} \nWriting: {}'.format(ifile,ofile))
+    start = time.time()
+    bufsize = int(chunk_sectors)*2048
     with open(ofile,'wb') as of:
-        _copy_buffered(gdifile,of)
+        if sparse:
+            written, skipped = _copy_sparse(gdifile, of, bufsize)
+        else:
+            written = _copy_buffered(gdifile, of, bufsize=bufsize)
+            skipped = 0
+    gdifile.__exit__()
+    print('Converted {}'.format(_throughput(written, time.time() - start)))
+    if skipped:
+        print('Skipped {:.1f} MiB of padding'.format(skipped / 1024. / 1024.))
+
+
+def _copy_sparse(src, dst, bufsize):
+    # Only the track data of AppendedFiles src is written to dst, seeking
+    # over the padding. 2048 bytes/sector tracks are copied by the kernel
+    # when it can. Returns (bytes written, bytes skipped).
+    written, skipped, end = 0, 0, 0
+    for start, end, track, offset in src.segments():
+        if track is None:
+            skipped += end - start
+            continue
+        dst.seek(start)
+        if _copy_physical(src, start, end - start, dst):
+            written += end - start
+            continue
+        src.seek(start)
+        for i in xrange(start, end, bufsize):
+            data = src.read(min(bufsize, end - i))
+            dst.write(data)
+            written += len(data)
+    dst.truncate(end)   # In case it ends with padding
+    return written, skipped
+
+def _printUsage(pname='gdifix.py'):
+    print('gdifix, converts a gdi dump into a valid iso file\n')
+    print('Usage: gdifix.py [options] disc.gdi [fixed.iso]')
+    print('\n  --chunk-sectors [num]  Sectors converted per batch. Default: 512')
+    print('  --no-sparse            Write the padding instead of leaving holes')
+    print('\nFamilyGuy 2014')
 
 def main(argv):
-    if len(argv) > 1 and os.path.isfile(argv[1]):
-        gdifix(*argv[1:])
+    try:
+        opts, args = getopt.gnu_getopt(argv[1:], '', ['chunk-sectors=',
+                                                      'no-sparse'])
+    except getopt.GetoptError as e:
+        print('{}\n'.format(e))
+        _printUsage(argv[0])
+        sys.exit(2)
+
+    kwargs = {}
+    for opt, arg in opts:
+        if opt == '--chunk-sectors':
+            if not arg.isdigit() or int(arg) < 1:
+                print('{} should be a number of sectors, at least 1\n'
+                      .format(opt))
+                _printUsage(argv[0])
+                sys.exit(2)
+            kwargs['chunk_sectors'] = int(arg)
+        elif opt == '--no-sparse':
+            kwargs['sparse'] = False
+
+    if len(args) > 0 and os.path.isfile(args[0]):
+        gdifix(*args, **kwargs)
     else:
-        print('gdifix, converts a gdi dump into a valid iso file\n')
-        print('Usage: gdifix.py disc.gdi [fixed.iso]')
-        print('\nFamilyGuy 2014')
+        _printUsage(argv[0])
 
 if __name__ == '__main__':
     main(sys.argv)
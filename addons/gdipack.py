@@ -0,0 +1,165 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    gdipack, packs the tracks of a gdi dump so gditools can read them
+    compressed, or unpacks them back to plain .bin/.raw/.iso tracks.
+
+    Packed tracks are cut in blocks of whole sectors compressed one by
+    one, so listing or extracting a few files only decompresses what
+    they cover. See PackedTrack in gditools.py.
+
+    This is an example of a simple program that uses gditools.py as a
+    base library to handle gdi files in a meaningful manner.
+
+    gdipack.py is released under the GNU General Public License
+    (version 3), a copy of which (GNU_GPL_v3.txt) is provided in the
+    license folder.
+"""
+
+import os, sys, getopt, time
+sys.path.append('..')
+sys.path.append('.')
+from gditools import (pack_track, unpack_track, is_packed, PACKED_CODECS,
+                      _throughput)
+
+PACKED_EXT = '.gdz'
+
+
+def gdipack(ifile, outdir = '', unpack = False, data_only = False,
+            delete = False, **kwargs):
+    """
+    Packs (or unpacks) the tracks of the gdi ifile into outdir, which
+    also gets the gdi listing them. outdir can be the folder of ifile,
+    the gdi is then replaced once all tracks are done.
+
+    Packed tracks are named like the original ones plus .gdz.
+
+    data_only: Only the data tracks, audio ones are left as they are
+    delete: Remove the tracks that were converted from ifile's folder
+    kwargs: codec, level and block_sectors, see pack_track
+    """
+    ifile = os.path.realpath(ifile)
+    dirname = os.path.dirname(ifile)
+    outdir = os.path.realpath(outdir or dirname)
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    with open(ifile) as f:
+        lines = [i.split() for i in f.readlines() if i.split()]
+
+    start = time.time()
+    done, before, after = [], 0, 0
+    for line in lines[1:]:
+        name = line[4]
+        src = os.path.join(dirname, name)
+        if unpack:
+            convert = is_packed(src)
+            if convert and name.endswith(PACKED_EXT):
+                line[4] = name[:-len(PACKED_EXT)]
+        else:
+            convert = not is_packed(src) and not (data_only and line[2] != '4')
+            if convert:
+                line[4] = name + PACKED_EXT
+        dst = os.path.join(outdir, line[4])
+
+        if not convert:
+            if dst != src:
+                _copy_file(src, dst)
+            continue
+        if dst == src:
+            raise ValueError('{} would be overwritten, use another '
+                             'output directory'.format(src))
+        print('{} {} -> {}'.format('Unpacking' if unpack else 'Packing',
+                                   name, line[4]))
+        before += os.path.getsize(src)
+        if unpack:
+            unpack_track(src, dst)
+        else:
+            pack_track(src, dst, sector_size = int(line[3]), **kwargs)
+        after += os.path.getsize(dst)
+        done.append(src)
+
+    # The gdi goes last, it's only valid once all its tracks are there
+    gdi = os.path.join(outdir, os.path.basename(ifile))
+    with open(gdi + '.tmp', 'w') as f:
+        f.write(lines[0][0] + '\n')
+        f.write(''.join([' '.join(i) + '\n' for i in lines[1:]]))
+    if os.path.exists(gdi): # os.rename won't on Windows
+        os.remove(gdi)
+    os.rename(gdi + '.tmp', gdi)
+
+    if delete:
+        for i in done:
+            os.remove(i)
+
+    print('Converted {}'.format(_throughput(max(before, after),
+                                            time.time() - start)))
+    if before:
+        print('{:.1f} MiB -> {:.1f} MiB ({:.1%})'.format(
+              before / 1024. / 1024., after / 1024. / 1024.,
+              float(after) / before))
+
+
+def _copy_file(src, dst, bufsize = 1*1024*1024):
+    with open(src, 'rb') as f1, open(dst, 'wb') as f2:
+        data = f1.read(bufsize)
+        while data:
+            f2.write(data)
+            data = f1.read(bufsize)
+
+
+def _printUsage(pname='gdipack.py'):
+    print('gdipack, packs the tracks of a gdi dump for gditools\n')
+    print('Usage: {} [options] disc.gdi\n'.format(pname))
+    print('  -h, --help             Display this help')
+    print('  -o [outdir]            Output directory. Default: gdi folder')
+    print('  -u, --unpack           Unpack the tracks instead')
+    print('  --codec [name]         One of {}. Default: zlib'.format(
+          ', '.join(PACKED_CODECS)))
+    print('  --level [num]          Compression level. Default: the codec\'s')
+    print('  --block-sectors [num]  Sectors per compressed block. Default: 16')
+    print('  --data-only            Leave the audio tracks as they are')
+    print('  --delete               Remove the converted tracks afterwards')
+
+
+def main(argv):
+    try:
+        opts, args = getopt.gnu_getopt(argv[1:], 'ho:u',
+                                       ['help', 'unpack', 'codec=', 'level=',
+                                        'block-sectors=', 'data-only',
+                                        'delete'])
+    except getopt.GetoptError:
+        _printUsage(argv[0])
+        sys.exit(2)
+
+    kwargs = {}
+    for opt, arg in opts:
+        if opt in ['-h', '--help']:
+            _printUsage(argv[0])
+            sys.exit()
+        elif opt == '-o':
+            kwargs['outdir'] = arg
+        elif opt in ['-u', '--unpack']:
+            kwargs['unpack'] = True
+        elif opt == '--codec':
+            if not arg in PACKED_CODECS:
+                _printUsage(argv[0])
+                sys.exit(2)
+            kwargs['codec'] = arg
+        elif opt == '--level':
+            kwargs['level'] = int(arg)
+        elif opt == '--block-sectors':
+            kwargs['block_sectors'] = int(arg)
+        elif opt == '--data-only':
+            kwargs['data_only'] = True
+        elif opt == '--delete':
+            kwargs['delete'] = True
+
+    if len(args) == 1 and os.path.isfile(args[0]):
+        gdipack(args[0], **kwargs)
+    else:
+        _printUsage(argv[0])
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,344 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    gdisynth, writes synthetic gdi dumps: 3-track or multi-track sets
+    with proper Mode 1 raw sectors (or 2048 bytes/sector ones), an
+    ISO9660 filesystem and generated files, to test and benchmark
+    gditools without real dumps.
+
+    This is an example of a simple program that uses gditools.py as a
+    base library to handle gdi files in a meaningful manner.
+
+    gdisynth.py is released under the GNU General Public License
+    (version 3), a copy of which (GNU_GPL_v3.txt) is provided in the
+    license folder.
+"""
+
+import os, sys, getopt, time, random, struct
+sys.path.append('..')
+sys.path.append('.')
+from gditools import _throughput
+from gdiverify import encode_sectors
+
+
+# File sizes, by distribution name
+SIZES = {
+    'tiny':  lambda rnd: rnd.choice([0, 1, 100, 2047, 2048, 2049]),
+    'small': lambda rnd: rnd.randrange(64*1024),
+    'mixed': lambda rnd: rnd.choice([0, 1, 2047, 2048, 2049,
+                                     min(int(rnd.lognormvariate(10, 2)),
+                                         64*1024*1024)]),
+    'large': lambda rnd: rnd.randrange(1024*1024, 64*1024*1024),
+}
+
+
+def random_tree(files = 200, depth = 3, width = 4, sizes = 'mixed',
+                seed = 0):
+    """
+    Returns [(path, size), ...] of files spread in a directory tree at
+    most depth levels deep, with at most width subdirectories each.
+
+    sizes: Name of a distribution of SIZES, a fixed size, or a function
+           returning a size from a random.Random
+    """
+    rnd = random.Random(seed)
+    if isinstance(sizes, basestring):
+        sizes = SIZES[sizes]
+    elif isinstance(sizes, (int, long)):
+        sizes = (lambda size: lambda rnd: size)(sizes)
+
+    dirs, children = [''], {'': 0}
+    for i in xrange(files):
+        parent = rnd.choice(dirs)
+        if (parent.count('/') + bool(parent) < depth and
+                children[parent] < width and rnd.random() < 0.3):
+            name = (parent + '/' if parent else '') + 'D{:03d}'.format(i)
+            dirs.append(name)
+            children[parent] += 1
+            children[name] = 0
+    tree = []
+    for i in xrange(files):
+        parent = rnd.choice(dirs)
+        tree.append(((parent + '/' if parent else '') +
+                     'F{:05d}.BIN'.format(i), sizes(rnd)))
+    return tree
+
+
+def _file_chunks(index, size, seed = 0, chunk = 1024*1024):
+    # Reproducible content: a random 64 KiB block, rotated per file
+    block = _file_chunks.blocks.get(seed)
+    if block is None:
+        rnd = random.Random(seed)
+        block = ''.join(chr(rnd.randrange(256)) for i in xrange(64*1024))
+        _file_chunks.blocks[seed] = block
+    shift = (index*7919) % len(block)
+    pattern = (block[shift:] + block[:shift])*(min(chunk, size)/len(block) + 1)
+    for i in xrange(0, size, chunk):
+        yield pattern[:min(chunk, size - i)]
+_file_chunks.blocks = {}
+
+
+def _both32(n):
+    return struct.pack('<I', n) + struct.pack('>I', n)
+
+def _both16(n):
+    return struct.pack('<H', n) + struct.pack('>H', n)
+
+
+def _dir_record(name, ex_loc, ex_len, flags, date):
+    rec = ('\x00' + _both32(ex_loc) + _both32(ex_len) + date + chr(flags) +
+           '\x00\x00' + _both16(1) + chr(len(name)) + name)
+    if len(name) % 2 == 0:
+        rec += '\x00'   # Padding, so records have an even length
+    return chr(len(rec) + 1) + rec
+
+
+def _pack_records(records):
+    # Records never cross a sector boundary
+    data = ''
+    for i in records:
+        if len(data) % 2048 + len(i) > 2048:
+            data += '\x00'*(2048 - len(data) % 2048)
+        data += i
+    return data + '\x00'*(-len(data) % 2048)
+
+
+class _TrackWriter(object):
+    """
+    Writes the sectors of a data track, by increasing LBA, the gaps
+    being filled with 0x00 sectors. Raw tracks are encoded batch_sectors
+    at a time.
+    """
+    def __init__(self, filename, first_lba, raw = True, batch_sectors = 2048):
+        self._f = open(filename, 'wb')
+        self._lba = first_lba       # Next sector to be encoded
+        self._raw = raw
+        self._batch = batch_sectors
+        self._buff = []
+        self._buff_len = 0
+
+    def write(self, lba, data):
+        pos = self._lba*2048 + self._buff_len
+        if lba*2048 < pos:
+            raise ValueError('Sectors must be written by increasing LBA')
+        self._add('\x00'*(lba*2048 - pos))
+        self._add(data + '\x00'*(-len(data) % 2048))
+
+    def _add(self, data):
+        self._buff.append(data)
+        self._buff_len += len(data)
+        if self._buff_len >= self._batch*2048:
+            self._flush()
+
+    def _flush(self, last = False):
+        data = ''.join(self._buff)
+        size = len(data) if last else len(data) - len(data) % (self._batch*2048)
+        for i in xrange(0, size, self._batch*2048):
+            chunk = data[i:min(size, i + self._batch*2048)]
+            self._f.write(encode_sectors(chunk, self._lba) if self._raw
+                          else chunk)
+            self._lba += len(chunk)/2048
+        self._buff = [data[size:]] if size < len(data) else []
+        self._buff_len = len(data) - size
+
+    def close(self, end_lba = None):
+        if end_lba is not None:
+            self.write(end_lba, '')
+        self._flush(last = True)
+        self._f.close()
+
+
+def build_gdi(outdir, tree, tracks = 3, raw = True, last_lba = None,
+              audio_sectors = 300, seed = 0, date = None):
+    """
+    Writes disc.gdi and its tracks in outdir, with the files of tree
+    (see random_tree). Returns the number of sectors of the filesystem.
+
+    tracks: 3, or more to put the directories and files in the last
+            track, with audio tracks in between
+    raw: 2352 bytes/sector data tracks, else 2048 bytes/sector ones
+    last_lba: LBA of the last track, default: right after the others
+    """
+    date = date or struct.pack('<6Bb', 114, 12, 25, 13, 37, 42, -20)
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    # Directories, with the path table order: by level, then parent
+    dirs = {'': []}
+    for n, (path, size) in enumerate(tree):
+        parts = path.split('/')
+        for i in range(1, len(parts)):
+            name = '/'.join(parts[:i])
+            if not name in dirs:
+                dirs[name] = []
+                dirs['/'.join(parts[:i - 1])].append((parts[i - 1], name))
+        dirs['/'.join(parts[:-1])].append((parts[-1] + ';1', n))
+    order = ['']
+    for i in order:
+        order += sorted(j for k, j in dirs[i] if isinstance(j, str))
+    number = dict((j, i + 1) for i, j in enumerate(order))
+    dir_loc = {}
+
+    def path_table(fmt):
+        table = ''
+        for i in order:
+            name = i.split('/')[-1] if i else '\x00'
+            parent = number['/'.join(i.split('/')[:-1])]
+            table += (chr(len(name)) + '\x00' + 
+                      struct.pack(fmt, dir_loc.get(i, 0), parent) + name +
+                      '\x00'*(len(name) % 2))
+        return table
+    table_size = len(path_table('<IH'))
+    table_sectors = (table_size + 2047)/2048
+
+    # Layout
+    ext = '.bin' if raw else '.iso'
+    t3_end = 45000 + 18 + 2*table_sectors
+    if tracks > 3:
+        t3_end = max(t3_end, 45000 + 64)    # Past the wormhole
+        audio_lbas = [t3_end + 150 + i*(audio_sectors + 150)
+                      for i in range(tracks - 4)]
+        if last_lba is None:
+            last_lba = t3_end + 150 + (tracks - 4)*(audio_sectors + 150)
+        lba = last_lba
+    else:
+        lba = t3_end
+
+    sizes = dict((i, len(_pack_records(
+                    ['\x00'*34]*2 + [_dir_record(k, 0, 0, 0, date)
+                                     for k, j in dirs[i]]))) for i in order)
+    for i in order:
+        dir_loc[i] = lba
+        lba += sizes[i]/2048
+    file_loc = []
+    for path, size in tree:
+        file_loc.append(lba)
+        lba += (size + 2047)/2048
+    end = lba if tracks > 3 else max(lba, 45000 + 64)  # Past the wormhole
+
+    # System area: ip.bin, pvd, terminator & path tables
+    ip = ('SEGA SEGAKATANA SEGA ENTERPRISES'.ljust(0x80) +
+          'SYNTHETIC TEST IMAGE'.ljust(0x80)).ljust(16*2048, '\x00')
+    root = dir_loc['']
+    pvd = ('\x01CD001\x01\x00' + 'SEGA SEGAKATANA'.ljust(32) +
+           'SYNTHETIC'.ljust(32) + '\x00'*8 + _both32(end) + '\x00'*32 +
+           _both16(1) + _both16(1) + _both16(2048) +
+           _both32(table_size) +
+           struct.pack('<II', 45018, 0) +
+           struct.pack('>II', 45018 + table_sectors, 0) +
+           _dir_record('\x00', root, sizes[''], 2, date) +
+           'GDISYNTH'.ljust(128) + 'GDITOOLS'.ljust(128) +
+           'GDISYNTH'.ljust(128) + 'GDISYNTH'.ljust(128) + ' '*37*3 +
+           '2014122513374200\x00'*4 + '\x01')
+
+    track = _TrackWriter(os.path.join(outdir, 'track03' + ext), 45000, raw)
+    track.write(45000, ip)
+    track.write(45016, pvd)
+    track.write(45017, '\xffCD001\x01')
+    track.write(45018, path_table('<IH'))
+    track.write(45018 + table_sectors, path_table('>IH'))
+    if tracks > 3:
+        track.close(t3_end)
+        track = _TrackWriter(os.path.join(outdir, 'track{:02d}{}'.format(
+                                                        tracks, ext)),
+                             last_lba, raw)
+
+    for i in order:
+        parent = '/'.join(i.split('/')[:-1])
+        records = [_dir_record('\x00', dir_loc[i], sizes[i], 2, date),
+                   _dir_record('\x01', dir_loc[parent], sizes[parent], 2,
+                               date)]
+        for name, j in sorted(dirs[i]):
+            if isinstance(j, str):
+                records.append(_dir_record(name, dir_loc[j], sizes[j], 2,
+                                           date))
+            else:
+                records.append(_dir_record(name, file_loc[j], tree[j][1], 0,
+                                           date))
+        track.write(dir_loc[i], _pack_records(records))
+
+    for n, (path, size) in enumerate(tree):
+        lba = file_loc[n]
+        for chunk in _file_chunks(n, size, seed):
+            track.write(lba, chunk)
+            lba += (len(chunk) + 2047)/2048
+    track.close(end)
+
+    # Low density area, audio tracks & gdi
+    mode = 2352 if raw else 2048
+    low = _TrackWriter(os.path.join(outdir, 'track01' + ext), 0, raw)
+    low.close(300)
+    lines = ['1 0 4 {} track01{} 0'.format(mode, ext),
+             '2 600 0 2352 track02.raw 0',
+             '3 45000 4 {} track03{} 0'.format(mode, ext)]
+    audio = [(2, 302)]
+    if tracks > 3:
+        for i, lba in enumerate(audio_lbas):
+            lines.append('{} {} 0 2352 track{:02d}.raw 0'.format(i + 4, lba,
+                                                                 i + 4))
+            audio.append((i + 4, audio_sectors))
+        lines.append('{} {} 4 {} track{:02d}{} 0'.format(tracks, last_lba,
+                                                         mode, tracks, ext))
+    for i, sectors in audio:
+        with open(os.path.join(outdir, 'track{:02d}.raw'.format(i)), 'wb') as f:
+            f.write('\x00'*2352*sectors)
+    with open(os.path.join(outdir, 'disc.gdi'), 'w') as f:
+        f.write('{}\n{}\n'.format(len(lines), '\n'.join(lines)))
+    return end - 45000
+
+
+def _printUsage(pname='gdisynth.py'):
+    print('gdisynth, writes a synthetic gdi dump\n')
+    print('Usage: {} [options] outdir\n'.format(pname))
+    print('  -h, --help             Display this help')
+    print('  --tracks [num]         Number of tracks. Default: 3')
+    print('  --iso                  2048 bytes/sector data tracks')
+    print('  --last-lba [num]       LBA of the last track of a multi-track set')
+    print('  --files [num]          Number of files. Default: 200')
+    print('  --depth [num]          Directory levels at most. Default: 3')
+    print('  --width [num]          Subdirectories per directory at most. Default: 4')
+    print('  --sizes [name]         File sizes: tiny, small, mixed, large or a')
+    print('                           fixed number of bytes. Default: mixed')
+    print('  --seed [num]           Seed of the tree & file contents. Default: 0')
+
+
+def main(argv):
+    try:
+        opts, args = getopt.gnu_getopt(argv[1:], 'h', 
+                                       ['help', 'tracks=', 'iso', 
+                                        'last-lba=', 'files=', 'depth=',
+                                        'width=', 'sizes=', 'seed='])
+    except getopt.GetoptError:
+        _printUsage(argv[0])
+        sys.exit(2)
+
+    tree_kwargs, build_kwargs = {}, {}
+    for opt, arg in opts:
+        if opt in ['-h', '--help']:
+            _printUsage(argv[0])
+            sys.exit()
+        elif opt == '--tracks':
+            build_kwargs['tracks'] = int(arg)
+        elif opt == '--iso':
+            build_kwargs['raw'] = False
+        elif opt == '--last-lba':
+            build_kwargs['last_lba'] = int(arg)
+        elif opt in ['--files', '--depth', '--width', '--seed']:
+            tree_kwargs[opt[2:]] = int(arg)
+        elif opt == '--sizes':
+            tree_kwargs['sizes'] = int(arg) if arg.isdigit() else arg
+    build_kwargs['seed'] = tree_kwargs.get('seed', 0)
+
+    if len(args) != 1:
+        _printUsage(argv[0])
+        sys.exit()
+
+    start = time.time()
+    sectors = build_gdi(args[0], random_tree(**tree_kwargs), **build_kwargs)
+    print('Wrote {} in {}'.format(os.path.join(args[0], 'disc.gdi'),
+                                  _throughput(sectors*2048,
+                                              time.time() - start)))
+
+if __name__ == '__main__':
+    main(sys.argv)
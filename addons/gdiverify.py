@@ -0,0 +1,441 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    gdiverify, checks the sync pattern, address, mode, EDC and ECC of
+    every sector of the raw (2352 bytes/sector) data tracks of a gdi
+    dump, and tells which files the bad sectors belong to.
+
+    This is an example of a simple program that uses gditools.py as a
+    base library to handle gdi files in a meaningful manner.
+
+    gdiverify.py is released under the GNU General Public License
+    (version 3), a copy of which (GNU_GPL_v3.txt) is provided in the
+    license folder.
+"""
+
+import os, sys, getopt, time, bisect, multiprocessing
+from binascii import hexlify, unhexlify
+sys.path.append('..')
+sys.path.append('.')
+from gditools import (GDIfile, parse_gdi, get_filesize, is_packed,
+                      PackedTrack, _throughput)
+
+
+# Mode 1 sector layout
+#    0 -   11  Sync pattern
+#   12 -   14  Address (MSF, BCD)
+#   15         Mode
+#   16 - 2063  User data
+# 2064 - 2067  EDC, over bytes 0 - 2063
+# 2068 - 2075  Zeros
+# 2076 - 2247  P parity, over bytes 12 - 2075
+# 2248 - 2351  Q parity, over bytes 12 - 2247
+
+SECTOR = 2352
+SYNC = '\x00' + '\xff'*10 + '\x00'
+
+# (major count, minor count, major mult, minor inc), as in ecm.c
+_P_BLOCK = (86, 24, 2, 86)
+_Q_BLOCK = (52, 43, 86, 88)
+
+
+def _edc_lut():
+    lut = []
+    for i in range(256):
+        e = i
+        for j in range(8):
+            e = (e >> 1) ^ (0xD8018001 if e & 1 else 0)
+        lut.append(e)
+    return lut
+
+
+def _gf_luts():
+    # Multiplication by 2, and division by 3, in GF(2^8)
+    f = [((i << 1) ^ (0x11D if i & 0x80 else 0)) & 0xFF for i in range(256)]
+    b = [0]*256
+    for i in range(256):
+        b[i ^ f[i]] = i
+    return f, b
+
+
+def _linear_table(basis):
+    # Values of a linear map for the 256 bytes, from the images of bits
+    values = [0]
+    for i in basis:
+        values += [j ^ i for j in values]
+    return values
+
+
+def _byte_table(values, shift = 0):
+    return ''.join(chr((i >> shift) & 0xFF) for i in values)
+
+
+def _ecc_contributions(block, f_lut, b_lut):
+    """
+    The ECC being linear, a byte t at position index (from offset 12)
+    adds c*t to the a and a^b outputs of its major, in GF(2^8).
+
+    Returns {index: (major, c for a, c for a^b)}
+    """
+    major_count, minor_count, major_mult, minor_inc = block
+    size = major_count*minor_count
+    contributions = {}
+    for major in range(major_count):
+        index = (major >> 1)*major_mult + (major & 1)
+        for minor in range(minor_count):
+            a = 1
+            for i in range(minor_count - minor):
+                a = f_lut[a]
+            a = b_lut[f_lut[a] ^ 1]
+            contributions[index] = (major, a, a ^ 1)
+            index += minor_inc
+            if index >= size:
+                index -= size
+    return contributions
+
+
+def _build_plan():
+    """
+    The checks are done over whole columns of a batch of sectors, the
+    column of position p being data[p::2352]. Every check byte is the
+    XOR of per-position lookup tables applied to the columns (which
+    str.translate does at C speed), minus the stored value: a batch is
+    valid when the accumulated XORs, kept as longs, are all zero.
+
+    Accumulators: ('P', major) holds the a and a^b P parity slots and
+    the 4 EDC byte slots, which are XORed together across P majors at
+    the end. ('Q', major) holds the a and a^b Q parity slots.
+
+    Returns [(position, [(accumulator, tables), ...]), ...], tables
+    giving, slot by slot, a translate table, None to XOR the column
+    as is or False to leave the slot alone.
+    """
+    edc_lut = _edc_lut()
+    f_lut, b_lut = _gf_luts()
+    gf_tables = {}
+    def gf_table(c):
+        if not c in gf_tables:
+            basis = [c]
+            for i in range(7):
+                basis.append(f_lut[basis[-1]])
+            gf_tables[c] = _byte_table(_linear_table(basis))
+        return gf_tables[c]
+
+    # EDC of a sector with byte v at position p and zeros elsewhere,
+    # for the 8 bits of v, going backward from the last position
+    edc_basis = [[0]*8 for p in range(2064)]
+    edc_basis[2063] = [edc_lut[1 << i] for i in range(8)]
+    for p in range(2062, -1, -1):
+        edc_basis[p] = [(e >> 8) ^ edc_lut[e & 0xFF]
+                        for e in edc_basis[p + 1]]
+
+    p_ecc = _ecc_contributions(_P_BLOCK, f_lut, b_lut)
+    q_ecc = _ecc_contributions(_Q_BLOCK, f_lut, b_lut)
+
+    plan = []
+    for p in range(SECTOR):
+        entries = {}
+        def add(acc, slot, table, slots):
+            entries.setdefault(acc, [False]*slots)[slot] = table
+
+        if p < 2064:
+            values = _linear_table(edc_basis[p])
+            for i in range(4):
+                add(('P', (p - 12) % 86 if p >= 12 else p), 2 + i,
+                    _byte_table(values, 8*i), 6)
+        elif p < 2068:                          # Stored EDC
+            add(('P', (p - 12) % 86), 2 + p - 2064, None, 6)
+
+        if 12 <= p < 2076:
+            major, ca, cb = p_ecc[p - 12]
+            add(('P', major), 0, gf_table(ca), 6)
+            add(('P', major), 1, gf_table(cb), 6)
+        elif 2076 <= p < 2248:                  # Stored P parity
+            add(('P', (p - 2076) % 86), (p - 2076)/86, None, 6)
+
+        if 12 <= p < 2248:
+            major, ca, cb = q_ecc[p - 12]
+            add(('Q', major), 0, gf_table(ca), 2)
+            add(('Q', major), 1, gf_table(cb), 2)
+        elif 2248 <= p:                         # Stored Q parity
+            add(('Q', (p - 2248) % 52), (p - 2248)/52, None, 2)
+
+        plan.append((p, sorted(entries.items())))
+    return plan
+
+_plan = None
+
+def _get_plan():
+    global _plan
+    if _plan is None:
+        _plan = _build_plan()
+    return _plan
+
+
+def _accumulate(data, n, positions, accs):
+    # XORs the contributions of the columns at positions into accs
+    plan = _get_plan()
+    zero = '\x00'*n
+    for p in positions:
+        column = str(data[p::SECTOR])
+        for acc, tables in plan[p][1]:
+            tmp = ''.join(zero if t is False else
+                          column if t is None else
+                          column.translate(t) for t in tables)
+            accs[acc] = accs.get(acc, 0) ^ long(hexlify(tmp), 16)
+    return accs
+
+
+def _edc_slots(accs, n):
+    # The 4 EDC slots, XORed together across P majors
+    edc = 0
+    for (kind, major), value in accs.items():
+        if kind == 'P':
+            edc ^= value & ((1 << 32*n) - 1)
+    return edc
+
+
+def _bcd(n):
+    return ((n / 10) << 4) | (n % 10)
+
+
+def _msf_columns(first_lba, n):
+    # Expected columns of the address bytes, at positions 12, 13 & 14
+    msf = [first_lba + i + 150 for i in xrange(n)]
+    return [''.join(chr(_bcd(i/4500)) for i in msf),
+            ''.join(chr(_bcd(i/75 % 60)) for i in msf),
+            ''.join(chr(_bcd(i % 75)) for i in msf)]
+
+
+def _to_bytes(value, length):
+    return unhexlify('{:0{}x}'.format(value, 2*length))
+
+
+def _nonzero(value, length):
+    # Indexes of the non-zero bytes of a long holding length bytes
+    return [i for i, c in enumerate(_to_bytes(value, length)) if c != '\x00']
+
+
+def _slot(value, slot, slots, length):
+    return (value >> (8*length*(slots - 1 - slot))) & ((1 << 8*length) - 1)
+
+
+def verify_sectors(data, first_lba):
+    """
+    Verifies a batch of whole Mode 1 sectors, the first one at LBA
+    first_lba.
+
+    Returns {lba: [problem, ...]} for the bad sectors, problems being
+    'sync', 'address', 'mode', 'zeros', 'edc', 'ecc-p' and 'ecc-q'.
+    """
+    n = len(data)/SECTOR
+    data = data[:n*SECTOR]
+    bad = {}
+    def report(indexes, problem):
+        for i in indexes:
+            problems = bad.setdefault(first_lba + i, [])
+            if not problem in problems:
+                problems.append(problem)
+
+    def compare(p, expected, problem):
+        column = data[p::SECTOR]
+        if column != expected:
+            report([i for i in xrange(n) if column[i] != expected[i]],
+                   problem)
+
+    for p in range(12):
+        compare(p, SYNC[p]*n, 'sync')
+    for p, expected in zip([12, 13, 14], _msf_columns(first_lba, n)):
+        compare(p, expected, 'address')
+    compare(15, '\x01'*n, 'mode')
+    for p in range(2068, 2076):
+        compare(p, '\x00'*n, 'zeros')
+
+    accs = _accumulate(data, n, xrange(SECTOR), {})
+    ecc_p, ecc_q = 0, 0
+    for (kind, major), value in accs.items():
+        if kind == 'P':
+            ecc_p |= _slot(value, 0, 6, n) | _slot(value, 1, 6, n)
+        else:
+            ecc_q |= _slot(value, 0, 2, n) | _slot(value, 1, 2, n)
+    edc = _edc_slots(accs, n)
+    edc = reduce(lambda a, b: a | b, [_slot(edc, i, 4, n) for i in range(4)])
+
+    for value, problem in [(edc, 'edc'), (ecc_p, 'ecc-p'), (ecc_q, 'ecc-q')]:
+        if value:
+            report(_nonzero(value, n), problem)
+    return bad
+
+
+def encode_sectors(data, first_lba):
+    """
+    Returns the Mode 1 raw sectors of data, made of whole 2048 bytes 
+    blocks, the first one at LBA first_lba. It's verify_sectors the 
+    other way around: the EDC is computed over the sectors without it,
+    then P parity with the EDC in, then Q parity with P in.
+    """
+    n = len(data)/2048
+    raw = bytearray(n*SECTOR)
+    for p in range(12):
+        raw[p::SECTOR] = SYNC[p]*n
+    for p, column in zip([12, 13, 14], _msf_columns(first_lba, n)):
+        raw[p::SECTOR] = column
+    raw[15::SECTOR] = '\x01'*n
+    for p in range(2048):
+        raw[16 + p::SECTOR] = data[p:n*2048:2048]
+
+    accs = _accumulate(raw, n, xrange(2064), {})
+    edc = _edc_slots(accs, n)
+    for i in range(4):
+        raw[2064 + i::SECTOR] = _to_bytes(_slot(edc, i, 4, n), n)
+
+    _accumulate(raw, n, xrange(2064, 2076), accs)
+    for (kind, major), value in accs.items():
+        if kind == 'P':
+            raw[2076 + major::SECTOR] = _to_bytes(_slot(value, 0, 6, n), n)
+            raw[2162 + major::SECTOR] = _to_bytes(_slot(value, 1, 6, n), n)
+
+    _accumulate(raw, n, xrange(2076, 2248), accs)
+    for (kind, major), value in accs.items():
+        if kind == 'Q':
+            raw[2248 + major::SECTOR] = _to_bytes(_slot(value, 0, 2, n), n)
+            raw[2300 + major::SECTOR] = _to_bytes(_slot(value, 1, 2, n), n)
+    return str(raw)
+
+
+def data_tracks(gdi):
+    """
+    Returns [(filename, sector size, LBA of the first sector), ...] for
+    the data tracks of gdi listed by parse_gdi.
+    """
+    tracks = parse_gdi(gdi)
+    ret = [(tracks[0]['filename'], tracks[0]['mode'], 45000)]
+    if len(tracks) > 1:
+        lba = (tracks[1]['offset']/2048 + 45000 +
+               get_filesize(tracks[0]['filename'])/tracks[0]['mode'])
+        ret.append((tracks[1]['filename'], tracks[1]['mode'], lba))
+    return ret
+
+
+def _verify_batch(job):
+    filename, first_lba, sector, count = job
+    # Packed tracks give back their original sectors
+    f = PackedTrack(filename) if is_packed(filename) else open(filename, 'rb')
+    with f:
+        f.seek(sector*SECTOR)
+        data = f.read(count*SECTOR)
+    return len(data)/SECTOR, verify_sectors(data, first_lba + sector)
+
+
+def verify_track(filename, first_lba, batch_sectors = 4096, jobs = 1):
+    """
+    Yields (number of sectors, {lba: [problem, ...]}) batch after batch
+    of the raw track filename, the batches being verified by jobs 
+    processes. A trailing partial sector is ignored.
+    """
+    total = get_filesize(filename)/SECTOR
+    batches = [(filename, first_lba, i, min(batch_sectors, total - i))
+               for i in xrange(0, total, batch_sectors)]
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            for i in pool.imap(_verify_batch, batches):
+                yield i
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        for i in batches:
+            yield _verify_batch(i)
+
+
+def map_lbas(gdi, lbas):
+    """
+    Returns {lba: name} of what's stored at every lba of lbas: the name
+    of a file or directory of the filesystem, the bootsector or None.
+    """
+    with GDIfile(gdi) as gdifile:
+        extents = sorted((i['ex_loc'], i['ex_loc'] + (i['ex_len'] + 2047)/2048,
+                          i['name']) for i in gdifile.gen_records())
+    starts = [i[0] for i in extents]
+    ret = {}
+    for lba in lbas:
+        ret[lba] = 'IP.BIN (bootsector)' if 45000 <= lba < 45016 else None
+        i = bisect.bisect_right(starts, lba) - 1
+        while i >= 0 and not ret[lba]:
+            if extents[i][0] <= lba < extents[i][1]:
+                ret[lba] = extents[i][2]
+            i -= 1
+    return ret
+
+
+def gdiverify(gdi, batch_sectors = 4096, jobs = 1):
+    """
+    Verifies all the raw data tracks of gdi, with jobs processes, and 
+    prints a report.
+
+    Returns {lba: [problem, ...]} for the bad sectors.
+    """
+    bad = {}
+    for filename, mode, lba in data_tracks(gdi):
+        name = os.path.basename(filename)
+        if mode != SECTOR:
+            print('{}: {} bytes/sector, nothing to verify'.format(name, mode))
+            continue
+        start = time.time()
+        sectors = 0
+        for count, errors in verify_track(filename, lba, batch_sectors,
+                                                  jobs):
+            sectors += count
+            bad.update(errors)
+        print('{}: {} sectors verified, {}'.format(name, sectors,
+                    _throughput(sectors*SECTOR, time.time() - start)))
+
+    if bad:
+        names = map_lbas(gdi, bad.keys())
+        print('\n{} bad sectors:'.format(len(bad)))
+        for lba in sorted(bad):
+            print('  LBA {}: {}    ({})'.format(lba, ', '.join(bad[lba]),
+                                               names[lba] or 'no file'))
+    else:
+        print('\nAll sectors are fine.')
+    return bad
+
+
+def _printUsage(pname='gdiverify.py'):
+    print('gdiverify, checks the EDC/ECC of the sectors of a gdi dump\n')
+    print('Usage: gdiverify.py [options] disc.gdi')
+    print('\n  --batch-sectors [num]  Sectors verified at once. Default: 4096')
+    print('  --jobs [num]           Batches verified in parallel. Default: 1')
+
+def main(argv):
+    try:
+        opts, args = getopt.gnu_getopt(argv[1:], '', ['batch-sectors=', 'jobs='])
+    except getopt.GetoptError as e:
+        print('{}\n'.format(e))
+        _printUsage(argv[0])
+        sys.exit(2)
+
+    kwargs = {}
+    for opt, arg in opts:
+        if not arg.isdigit() or int(arg) < 1:
+            print('{} should be a number, at least 1\n'.format(opt))
+            _printUsage(argv[0])
+            sys.exit(2)
+        if opt == '--batch-sectors':
+            kwargs['batch_sectors'] = int(arg)
+        elif opt == '--jobs':
+            kwargs['jobs'] = int(arg)
+
+    if len(args) > 0 and os.path.isfile(args[0]):
+        if gdiverify(args[0], **kwargs):
+            sys.exit(1)
+    else:
+        _printUsage(argv[0])
+
+if __name__ == '__main__':
+    main(sys.argv)
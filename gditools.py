@@ -18,14 +18,32 @@
     provided in the licences folder: iso9660_licente.txt
 """
 
-import os, sys, getopt
-from iso9660 import ISO9660 as _ISO9660_orig
+import os, sys, errno, getopt, mmap, threading, multiprocessing, time, Queue
+import tarfile, zipfile, zlib, hashlib, functools, shutil, tempfile, bisect
+import json, csv, calendar, weakref
+from multiprocessing.pool import ThreadPool
+from itertools import izip
+from collections import OrderedDict
+from iso9660 import ISO9660 as _ISO9660_orig, ISO9660IOError
+import struct
 from struct import unpack
 from datetime import datetime
+from hashlib import md5
 try:
     from cStringIO import StringIO
 except ImportError:
     from StringIO import StringIO
+try:
+    import bz2
+except ImportError:
+    bz2 = None
+try:
+    import lzma     # Not in python 2.7 itself, backports.lzma provides it
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
 
 
 # TODO TODO TODO
@@ -38,6 +56,253 @@ except ImportError:
 # TODO TODO TODO
 
 
+# Bump when what's stored in filesystem cache files changes
+_CACHE_VERSION = 3
+
+# Digests available for hash manifests
+HASH_ALGORITHMS = ('crc32', 'md5', 'sha1')
+
+# Columns of the listings of print_listing, and their formats
+LISTING_FIELDS = ('name', 'ex_loc', 'ex_len', 'flags', 'timestamp', 'date',
+                  'track')
+LISTING_FORMATS = ('jsonl', 'csv')
+
+
+
+class Record(object):
+    """
+    A directory record, compact thanks to __slots__. Fields are reached
+    as attributes or like the dicts of iso9660.py: rec['ex_loc'].
+    """
+    __slots__ = ('ex_loc', 'ex_len', 'datetime', 'flags', 
+                 'interleave_unit_size', 'interleave_gap_size', 
+                 'volume_sequence', 'name')
+
+    def __init__(self, ex_loc, ex_len, datetime, flags, interleave_unit_size,
+                 interleave_gap_size, volume_sequence, name):
+        self.ex_loc = ex_loc
+        self.ex_len = ex_len
+        self.datetime = datetime
+        self.flags = flags
+        self.interleave_unit_size = interleave_unit_size
+        self.interleave_gap_size = interleave_gap_size
+        self.volume_sequence = volume_sequence
+        self.name = name
+
+    ### Mapping interface, so records can be used where dicts were
+
+    def __getitem__(self, key):
+        if not key in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if not key in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    has_key = __contains__
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def values(self):
+        return [getattr(self, i) for i in self.__slots__]
+
+    def items(self):
+        return [(i, getattr(self, i)) for i in self.__slots__]
+
+    def get(self, key, default = None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def copy(self):
+        return Record(*self.values())
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None     # Mutable, like a dict
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    ### Objects with __slots__ need these for pickle protocols < 2
+
+    def __getstate__(self):
+        return self.values()
+
+    def __setstate__(self, state):
+        for i, j in zip(self.__slots__, state):
+            setattr(self, i, j)
+
+
+
+class IOStats(object):
+    """
+    Counters and timers of the I/O of a GDIfile, see its kwarg *stats*.
+
+        seeks: {track: reads not starting where the last one ended}
+        bytes_read: {track: bytes read, sync, header, EDC & ECC included
+                     for 2352 bytes/sector tracks}
+        read_sizes: {size: reads of the tracks of at most size bytes,
+                     by powers of 2}
+        sectors_decoded: 2352 bytes/sector sectors de-interleaved
+        padding_bytes: Zeros served for what's before the tracks
+        fs_reads: Filesystem reads (descriptors, path table & dirs)
+        bytes_written: File data written, kernel copies included
+        kernel_bytes: File data copied inside the kernel
+        phases: {phase: seconds} spent in 'parse', 'walk', 'extract' and
+                'hash', a phase nested in another isn't counted in both
+    """
+    _COUNTERS = ('sectors_decoded', 'padding_bytes', 'fs_reads',
+                 'bytes_written', 'kernel_bytes')
+
+    def __init__(self):
+        self.start = time.time()
+        self.phases = {}
+        self._local = threading.local()  # Phases are nested per thread
+        self._phases_lock = threading.Lock()
+        self._ends = {}     # {track: where its last read ended}
+        self._reset()
+
+    def _reset(self):
+        self.seeks = {}
+        self.bytes_read = {}
+        self.read_sizes = {}
+        for i in self._COUNTERS:
+            setattr(self, i, 0)
+
+    def add_read(self, track, start, size, nbytes):
+        # A read of size bytes, nbytes at start of track being read
+        track = os.path.basename(track)
+        if nbytes and self._ends.get(track, 0) != start:
+            self.seeks[track] = self.seeks.get(track, 0) + 1
+        self._ends[track] = start + nbytes
+        self.bytes_read[track] = self.bytes_read.get(track, 0) + nbytes
+        size = 1 << (size - 1).bit_length() if size else 0
+        self.read_sizes[size] = self.read_sizes.get(size, 0) + 1
+
+    def _running(self):
+        # [(phase, since), ...] of this thread, innermost last
+        if not hasattr(self._local, 'running'):
+            self._local.running = []
+        return self._local.running
+
+    def _pause(self, running, now):
+        if running:
+            name, since = running[-1]
+            with self._phases_lock:
+                self.phases[name] = self.phases.get(name, 0.) + now - since
+
+    def enter(self, name):
+        now, running = time.time(), self._running()
+        self._pause(running, now)
+        running.append((name, now))
+
+    def exit(self):
+        now, running = time.time(), self._running()
+        self._pause(running, now)
+        running.pop()
+        if running:
+            running[-1] = (running[-1][0], now)
+
+    def timed(self, name, iterable):
+        # Yields what iterable does, getting the items being phase name
+        it = iter(iterable)
+        while True:
+            self.enter(name)
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                self.exit()
+            yield item
+
+    def as_dict(self):
+        ret = dict((i, getattr(self, i)) for i in self._COUNTERS)
+        ret.update(seeks = dict(self.seeks), bytes_read = dict(self.bytes_read),
+                   read_sizes = dict(self.read_sizes),
+                   phases = dict(self.phases), wall = time.time() - self.start)
+        return ret
+
+    def pop(self):
+        # as_dict, then counting starts over. Used by the workers.
+        ret = self.as_dict()
+        self._reset()
+        return ret
+
+    def merge(self, other):
+        # Adds the counters of other, as returned by as_dict
+        for i in self._COUNTERS:
+            setattr(self, i, getattr(self, i) + other[i])
+        for i in ['seeks', 'bytes_read', 'read_sizes']:
+            mine = getattr(self, i)
+            for key, value in other[i].items():
+                mine[key] = mine.get(key, 0) + value
+
+    def report(self):
+        """
+        Returns the lines of a human readable report.
+        """
+        mib = lambda n: '{:.1f} MiB'.format(n / 1024. / 1024.)
+        wall = time.time() - self.start
+        lines = ['Wall time:        {:.3f} s'.format(wall)]
+        for name in ['parse', 'walk', 'extract', 'hash']:
+            if self.phases.has_key(name):
+                lines.append('  {:16}{:.3f} s'.format(name, self.phases[name]))
+        lines.append('  {:16}{:.3f} s'.format('other',
+                                              wall - sum(self.phases.values())))
+        for track in sorted(self.bytes_read):
+            lines.append('{}: {} read, {} seeks'.format(
+                            track, mib(self.bytes_read[track]),
+                            self.seeks.get(track, 0)))
+        lines.append('Sectors decoded:  {}'.format(self.sectors_decoded))
+        lines.append('Padding served:   {}'.format(mib(self.padding_bytes)))
+        lines.append('Filesystem reads: {}'.format(self.fs_reads))
+        lines.append('Bytes written:    {} ({} in the kernel)'.format(
+                        mib(self.bytes_written), mib(self.kernel_bytes)))
+        lines.append('Read sizes:')
+        for size in sorted(self.read_sizes):
+            lines.append('  <= {:>10} bytes: {}'.format(size,
+                                                        self.read_sizes[size]))
+        return lines
+
+
+def _phase(name):
+    """
+    Decorator timing a method of ISO9660 as phase name of its IOStats,
+    if it has one.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self._stats is None:
+                return method(self, *args, **kwargs)
+            self._stats.enter(name)
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self._stats.exit()
+        return wrapper
+    return decorator
+
+
 
 class ISO9660(_ISO9660_orig):
     """
@@ -56,15 +321,101 @@ class ISO9660(_ISO9660_orig):
             if type(args[1]) == type({}):
                 self._dict2 = args[1]
 
-        self._gdifile = AppendedFiles(self._dict1, self._dict2)
-
-        _ISO9660_orig.__init__(self, 'url') # So url doesn't starts with http
+        # I/O counters & timers, see IOStats
+        self._stats = IOStats() if kwargs.pop('stats', False) else None
+
+        # Sector cache settings, see AppendedFiles
+        cache_kwargs = dict([(i, kwargs.pop(i)) for i in 
+                             ['cache_blocks', 'block_sectors', 'cache_bypass']
+                             if kwargs.has_key(i)])
+        self._gdifile = AppendedFiles(self._dict1, self._dict2, 
+                                      stats = self._stats, **cache_kwargs)
+        self._index = None  # Built by the first lookup, see _get_index
+        # Held around every seek & read pair of self._gdifile done for 
+        # ExtentFile handles and filesystem reads, as they share it. 
+        # Reentrant, so a GDIPool can hold it during a whole dump.
+        self._io_lock = threading.RLock()
 
         if kwargs.has_key('verbose'):
             self._verbose = kwargs.pop('verbose')
         else:
             self._verbose = False
 
+        # *cachefile* keeps the parsed filesystem between runs, it's 
+        # only trusted if the tracks didn't change since it was saved.
+        self._cachefile = kwargs.pop('cachefile', None)
+        self._dircache = None
+        if self._cachefile:
+            self._dircache = {}
+            if not self._load_cache():
+                self._parse_volume()
+                self._get_index()   # Walks and caches every directory
+                self._save_cache()
+        else:
+            self._parse_volume()
+
+
+    @_phase('parse')
+    def _parse_volume(self):
+        # Does what _ISO9660_orig.__init__ does, but each descriptor and 
+        # the path table are read at once and decoded with precompiled
+        # structs instead of many small reads from a StringIO.
+        self._buff = None
+        self._root = None
+        self._pvd = {}
+        self._paths = []
+        self._url = 'url'   # So url doesn't starts with http
+        self._get_sector = self._get_sector_file
+
+        ### Volume Descriptors
+        sector = 0x10
+        while True:
+            data = self._read_sectors(sector, 2048)
+            sector += 1
+            ty = ord(data[0])
+
+            if ty == 1:
+                self._unpack_pvd(data)
+            elif ty == 255:
+                break
+
+        ### Path table
+        l0 = self._pvd['path_table_size']
+        data = self._read_sectors(self._pvd['path_table_l_loc'], l0)
+        pos = 0
+        while l0 > 0:
+            l1, l2, ex_loc, parent = _PATH_ENTRY.unpack_from(data, pos)
+            name = data[pos + 8:pos + 8 + l1].rstrip(' ')
+            self._paths.append(dict(ex_loc = ex_loc, parent = parent, 
+                                    name = '' if name == '\x00' else name))
+            pos += 8 + l1 + (l1 % 2)
+            l0 -= 8 + l1 + (l1 % 2)
+
+        assert l0 == 0
+
+
+    def _unpack_pvd(self, data):
+        # data is the whole descriptor sector, type byte included
+        p = self._pvd
+        (p['type_code'], p['standard_identifier'], p['system_identifier'], 
+         p['volume_identifier'], p['volume_space_size'], 
+         p['volume_set_size'], p['volume_seq_num'], p['logical_block_size'],
+         p['path_table_size'], p['path_table_l_loc'], 
+         p['path_table_opt_l_loc']) = _PVD_HEAD.unpack_from(data, 0)
+        p['path_table_m_loc'], p['path_table_opt_m_loc'] = \
+            _PVD_M.unpack_from(data, 148)
+        l0, self._root = _unpack_dir_record(data, 156) 
+        (p['volume_set_identifer'], p['publisher_identifier'], 
+         p['data_preparer_identifier'], p['application_identifier'], 
+         p['copyright_file_identifier'], p['abstract_file_identifier'],
+         p['bibliographic_file_identifier'], p['volume_datetime_created'],
+         p['volume_datetime_modified'], p['volume_datetime_expires'],
+         p['volume_datetime_effective'], p['file_structure_version']) = \
+            _PVD_TAIL.unpack_from(data, 156 + l0)
+        for i in p:
+            if type(p[i]) == str and not i.startswith('volume_datetime'):
+                p[i] = p[i].rstrip(' ')
+
 
     
     ### Overriding this function allows to parse AppendedFiles as isos
@@ -72,64 +423,288 @@ class ISO9660(_ISO9660_orig):
     def _get_sector_file(self, sector, length): 
         # A big performance improvement versus re-opening the file for each
 	# read as in the original ISO9660 implementation.
-        self._gdifile.seek(sector*2048)
-        self._buff = StringIO(self._gdifile.read(length))
+        self._buff = StringIO(self._read_sectors(sector, length))
+
+
+    def _read_sectors(self, sector, length):
+        with self._io_lock:
+            if self._stats is not None:
+                self._stats.fs_reads += 1
+            self._gdifile.seek(sector*2048)
+            return self._gdifile.read_cached(length)
+
+
+    ### Directories are decoded whole, and with a cache they're read 
+    ### from the disc only once
+
+    def _unpack_dir_children(self, d):
+        if self._dircache is None:
+            return iter(self._dir_children(d))
+        if not self._dircache.has_key(d['ex_loc']):
+            self._dircache[d['ex_loc']] = self._dir_children(d)
+        return iter(self._dircache[d['ex_loc']])
+
+
+    def _dir_children(self, d):
+        # The size of the directory is the one of its '.' record
+        data = self._read_sectors(d['ex_loc'], 2048)
+        size = _DIR_RECORD.unpack_from(data, 0)[2]
+        if size > 2048:
+            data += self._read_sectors(d['ex_loc'] + 1, size - 2048)
+
+        children = []
+        pos = ord(data[0])      # Skips '.'
+        pos += ord(data[pos])   # Skips '..'
+        while pos < size:
+            if data[pos] == '\x00':    # Records don't span over sectors
+                pos = (pos / 2048 + 1) * 2048
+                continue
+            l0, rec = _unpack_dir_record(data, pos)
+            children.append(rec)
+            pos += l0
+        return children
+
+
+    ### Path lookups go through the index rather than the directories
+
+    def get_file(self, path):
+        return self.get_file_by_record(self.get_record(path))
+
+    def _dir_record_by_table(self, path):
+        return self.get_record('/'.join(path))
+
+    def _dir_record_by_root(self, path):
+        return self.get_record('/'.join(path))
 
 
     ### NEW FUNCTIONS FOLLOW ###
 
     def get_record(self, path):
-        path = path.upper().strip('/').split('/')
-        path, filename = path[:-1], path[-1]
+        """
+        Returns the record of a file or directory. Paths are matched 
+        case-insensitively, against an index of the whole filesystem
+        that is built on first use.
+        """
+        try:
+            return self._get_index()[self._index_key(path)]
+        except KeyError:
+            raise ISO9660IOError(path)
 
-        if len(path)==0:
-            parent_dir = self._root
-        else:
-            parent_dir = self._dir_record_by_root(path)
 
-        f = self._search_dir_children(parent_dir, filename)
-        return f
+    def has_record(self, path):
+        return self._index_key(path) in self._get_index()
+
+
+    def _index_key(self, path):
+        return path.upper().strip('/')
+
+
+    @_phase('walk')
+    def _get_index(self):
+        # Full path -> record, the records keep their short names just 
+        # like the ones read from the directories.
+        if self._index is None:
+            index = {'': self._root}
+            nodes = [('', self._root)]
+            while nodes:
+                path, node = nodes.pop()
+                for c in list(self._unpack_dir_children(node)):
+                    key = path + '/' + c['name'] if path else c['name']
+                    index[key.upper()] = c
+                    if c['flags'] & 2:
+                        nodes.append((key, c))
+            self._index = index
+        return self._index
 
 
     def gen_records(self, get_files = True):
-        gen = self._tree_nodes_records(self._root)
-        for i in gen:
-            if get_files:
+        # get_files = False only yields the directories
+        for i in self.walk_records(files = get_files):
+            if get_files or i['flags'] == 2:
                 yield i
-            elif i['flags'] == 2:
-                yield i 
 
 
-    def _tree_nodes_records(self, node):
-        spacer = lambda s: dict(
-                    {j:s[j] for j in [i for i in s if i != 'name']}.items(),
-                    name = "%s/%s" % (node['name'].lstrip('\x00\x01'), 
-                    s['name']))
-        for c in list(self._unpack_dir_children(node)):
-            yield spacer(c)
-            if c['flags'] & 2:
-                for d in self._tree_nodes_records(c):
-                    yield spacer(d)
+    def walk_records(self, files = True, dirs = True):
+        """
+        Yields the records of the whole filesystem with their full path
+        as name, each directory being followed by its content.
+
+        files, dirs: Whether file/directory records are yielded. The 
+                     directories are walked through either way.
+        """
+        if self._stats is not None:
+            return self._stats.timed('walk', self._walk_records(files, dirs))
+        return self._walk_records(files, dirs)
+
+    def _walk_records(self, files, dirs):
+        # One iterator per directory level instead of nested generators,
+        # every record is copied once, when it gets its full path.
+        stack = [('', self._unpack_dir_children(self._root))]
+        while stack:
+            path, children = stack[-1]
+            for c in children:
+                rec = c.copy()
+                rec.name = path + '/' + c.name
+                if c.flags & 2:
+                    if dirs:
+                        yield rec
+                    stack.append((rec.name, self._unpack_dir_children(c)))
+                    break
+                elif files:
+                    yield rec
+            else:
+                stack.pop()
+
+    def _cache_key(self):
+        # Identifies the tracks as parsed from the gdi file
+        key = [_CACHE_VERSION]
+        for d in [self._dict1, self._dict2]:
+            if d:
+                st = os.stat(d['filename'])
+                key.append([os.path.realpath(d['filename']), st.st_size,
+                            st.st_mtime, d['mode'], d['offset'],
+                            list(d.get('wormhole', []))])
+        return key
+
+    @_phase('parse')
+    def _load_cache(self):
+        try:
+            with open(self._cachefile, 'rb') as f:
+                cache = _from_json(json.load(f))
+            if cache['key'] != self._cache_key():
+                return False
+            root = Record(*cache['root'])
+            dircache = dict((ex_loc, [Record(*i) for i in children])
+                            for ex_loc, children in cache['dirs'])
+        except Exception:   # Missing, stale or unreadable: just rebuild
+            return False
+
+        # What _ISO9660_orig.__init__ would have set
+        self._buff = None
+        self._url = 'url'
+        self._get_sector = self._get_sector_file
+        self._pvd = cache['pvd']
+        self._root = root
+        self._paths = cache['paths']
+        self._dircache = dircache
+        if self._verbose:
+            print('Filesystem loaded from cache: {}'.format(self._cachefile))
+        return True
+
+    def _save_cache(self):
+        # JSON rather than pickle, caches may come along with the gdis
+        cache = dict(key = self._cache_key(), pvd = self._pvd, 
+                     root = self._root.values(), paths = self._paths, 
+                     dirs = [(ex_loc, [i.values() for i in children])
+                             for ex_loc, children in self._dircache.items()])
+        try:
+            path = os.path.dirname(self._cachefile)
+            if path and not os.path.exists(path):
+                os.makedirs(path)
+            with open(self._cachefile + '.tmp', 'wb') as f:
+                json.dump(cache, f, encoding = 'latin-1')
+            if os.path.exists(self._cachefile): # os.rename won't on Windows
+                os.remove(self._cachefile)
+            os.rename(self._cachefile + '.tmp', self._cachefile)
+        except EnvironmentError:
+            if self._verbose:
+                print('Could not write cache: {}'.format(self._cachefile))
 
     def get_pvd(self):
         return self._pvd
 
+    def sector_cache_info(self):
+        return self._gdifile.cache_info()
+
+    def io_stats(self):
+        """
+        Returns the counters and timers of IOStats as a dict, or None 
+        unless the kwarg *stats* was set.
+        """
+        return self._stats.as_dict() if self._stats else None
+
+    def print_io_stats(self):
+        if self._stats:
+            print('\n'.join(self._stats.report()))
+
     def get_volume_label(self):
         return self.get_pvd()['volume_identifier']
 
+    @_phase('walk')
     def print_files(self):
         for i in self.tree():
             print(i)
 
 
+    def gen_listing(self):
+        """
+        Yields an OrderedDict per record of the filesystem as it's 
+        walked, with the keys of LISTING_FIELDS:
+
+            timestamp: Seconds since the epoch (UTC), None if the date 
+                       of the record isn't valid
+            date: The date as recorded, with its offset from GMT
+            track: Filename of the track holding the first sector of
+                   the extent, None if it's padding
+        """
+        for rec in self.walk_records():
+            timestamp, date = _record_date(rec.datetime)
+            track = self._gdifile.track_of(rec.ex_loc*2048)
+            yield OrderedDict(zip(LISTING_FIELDS, 
+                        (rec.name, rec.ex_loc, rec.ex_len, rec.flags, 
+                         timestamp, date, 
+                         os.path.basename(track) if track else None)))
+
+
+    @_phase('walk')
+    def print_listing(self, fmt = 'jsonl', out = None):
+        """
+        Writes the rows of gen_listing to out (stdout by default) one 
+        at a time, so memory use doesn't depend on the filesystem size.
+
+        fmt: 'jsonl', a JSON object per line, or 'csv' with a header row
+        """
+        if not fmt in LISTING_FORMATS:
+            raise ValueError('Argument fmt should be one of {}'.format(
+                             ', '.join(LISTING_FORMATS)))
+        out = sys.stdout if out is None else out
+        if fmt == 'csv':
+            writer = csv.writer(out)
+            writer.writerow(LISTING_FIELDS)
+            for row in self.gen_listing():
+                writer.writerow(['' if i is None else i 
+                                 for i in row.values()])
+        else:
+            for row in self.gen_listing():
+                # Names are bytes, latin-1 never fails to decode them
+                out.write(json.dumps(row, encoding = 'latin-1') + '\n')
+
+
     def get_bootsector(self, lba = 45000):
         self._get_sector(lba, 16*2048)
         return self._unpack_raw(16*2048)
 
 
     def get_file_by_record(self, filerec):
-        self._gdifile.seek(filerec['ex_loc']*2048)
-        return self._gdifile.read(filerec['ex_len'])
+        with self._io_lock:
+            self._gdifile.seek(filerec['ex_loc']*2048)
+            return self._gdifile.read(filerec['ex_len'])
+
+
+    def open(self, path):
+        """
+        Returns a read-only, seekable ExtentFile of the file at path. 
+        Data is only read when asked, so memory use doesn't depend on 
+        the file size, and each handle has its own position.
+        """
+        return self.open_record(self.get_record(path))
+
+
+    def open_record(self, rec):
+        if rec['flags'] & 2:
+            raise IOError(errno.EISDIR, 'Is a directory', rec['name'])
+        return ExtentFile(self._gdifile, rec['ex_loc'], rec['ex_len'],
+                          name = rec['name'], lock = self._io_lock)
 
 
     def get_sorttxt(self, crit='ex_loc', prefix='data', dummy='0.0', spacer=1):
@@ -171,9 +746,8 @@ class ISO9660(_ISO9660_orig):
 
 
     def _sorted_records(self, crit='ex_loc'):
-        file_records = [i for i in self.gen_records()]
-        for i in self.gen_records(get_files = False):
-            file_records.pop(file_records.index(i))  # Strips directories
+        # Strips directories
+        file_records = [i for i in self.gen_records() if i['flags'] != 2]
         reverse = crit[0].islower()
         crit = crit.lower()
         ordered_records = sorted(file_records, key=lambda k: k[crit], 
@@ -181,6 +755,18 @@ class ISO9660(_ISO9660_orig):
         return ordered_records
 
 
+    def _planned_reads(self, records, gap = 0, size = 0):
+        # Yields (record, what to read its data from), the files of the
+        # runs of _plan_reads being read at once.
+        for start, length, recs in _plan_reads(records, gap, size):
+            src = self._gdifile
+            if len(recs) > 1:
+                with self._io_lock:
+                    src = _ReadAhead(self._gdifile, start, length)
+            for rec in recs:
+                yield rec, src
+
+
     def _sorttxt_from_records(self, records, prefix='data', dummy='0.0', spacer = 1):
         spacer = int(spacer)
         sorttxt=''
@@ -230,14 +816,36 @@ class ISO9660(_ISO9660_orig):
                 print('Dumping bootsector to {}'.format(filename))
             f.write(self.get_bootsector())
 
+    @_phase('extract')
     def dump_file_by_record(self, rec, target = '.', keep_timestamp = True,
-                            filename = None):
+                            filename = None, digest = None, store = None,
+                            src = None):
         """
         rec: Record of a file in the filesystem
         target: Directory target to dump file into
         keep_timestamp: Uses timestamp in fs for dumped file
         filename: *None* -> Uses name in fs, else it overrides filename
+        digest: Digester fed with the file data as it's copied, if any
+        store: ContentStore the data goes in, the file being a link to 
+               it, if any. Its key is returned then.
+        src: What the data is read from, the image if None. See 
+             _planned_reads.
         """
+        filename = self._prepare_dump(rec, target, filename)
+
+        if rec['flags'] != 2:   # If rec doesn't represents a directory
+            self._report_dump(rec, filename)
+            # Using buffered copy to speed up things, hopefully
+            # Potentially beneficial on Windows mainly
+            return _dump_extent(self._gdifile if src is None else src,
+                                rec['ex_loc'], rec['ex_len'],
+                                filename, 
+                                self._dump_timestamp(rec, keep_timestamp),
+                                digest, store, self._io_lock)
+
+
+    def _prepare_dump(self, rec, target, filename = None):
+        # Returns the output filename of rec, creating its directories
         if not target[-1] == '/': target += '/'
         # User provided filename overrides records's subfolders & name
         if filename:
@@ -256,21 +864,19 @@ class ISO9660(_ISO9660_orig):
             if self._verbose: 
                 message = 'Created directory: {}'
                 UpdateLine(message.format(path))
+        return filename
 
-        if rec['flags'] != 2:   # If rec doesn't represents a directory
-            message = 'Dumping {} to {}    ({}, {})'
-            if self._verbose: 
-                UpdateLine(message.format(rec['name'].split('/')[-1],
-                                          filename, rec['ex_loc'],
-                                          rec['ex_len']))
-            with open(filename, 'wb') as f:
-                # Using buffered copy to speed up things, hopefully
-                # Potentially beneficial on Windows mainly
-                self._gdifile.seek(rec['ex_loc']*2048)
-                _copy_buffered(self._gdifile, f, length = rec['ex_len'])
 
-            if keep_timestamp:
-                os.utime(filename, (self._get_timestamp_by_record(rec),)*2)
+    def _report_dump(self, rec, filename):
+        message = 'Dumping {} to {}    ({}, {})'
+        if self._verbose: 
+            UpdateLine(message.format(rec['name'].split('/')[-1],
+                                      filename, rec['ex_loc'],
+                                      rec['ex_len']))
+
+
+    def _dump_timestamp(self, rec, keep_timestamp = True):
+        return self._get_timestamp_by_record(rec) if keep_timestamp else None
 
 
     def dump_file(self, name, **kwargs):
@@ -279,15 +885,122 @@ class ISO9660(_ISO9660_orig):
             UpdateLine('\n')
 
 
-    def dump_all_files(self, target='data', **kwargs): 
+    @_phase('extract')
+    def dump_all_files(self, target='data', workers = 1, executor = 'process',
+                       archive = None, manifest = None, 
+                       algorithms = HASH_ALGORITHMS, cancel = None, 
+                       incremental = False, checkpoint = None, store = None,
+                       coalesce_gap = 64*1024, coalesce_size = 4*1024*1024,
+                       **kwargs): 
+        """
+        target: Directory target to dump files into, relative to the gdi
+                folder unless it's a full path
+        workers: Number of files extracted in parallel. Each worker opens
+                 its own handles on the tracks.
+        executor: 'process' or 'thread', what the workers are made of
+        archive: Filename of a .tar, .tar.gz, .tgz, .tar.bz2, .tbz2 or 
+                 .zip archive the files are streamed into instead of the
+                 filesystem, target being their folder in the archive.
+        manifest: Filename of a hash manifest of the files, whose digests
+                  are computed while they're dumped, see dump_manifest
+        algorithms: Digests of the manifest, any of HASH_ALGORITHMS
+        cancel: threading.Event, once it's set the dump stops before the
+                next file raising CancelledError, see GDIPool
+        incremental: Skips the files already in target with the same 
+                     size and timestamp (unless keep_timestamp is False).
+                     One of HASH_ALGORITHMS also compares their digest 
+                     with the one of the data in the image.
+        checkpoint: Filename where the files are recorded as they're 
+                    dumped, so a dump that was interrupted skips them 
+                    when it's started again. It's removed once all files
+                    are dumped. Relative to the gdi folder unless it's a
+                    full path.
+        store: ContentStore, or the folder of one, where the contents of
+               the files go, each one once whatever the images. The 
+               files in target are links to them. Relative to the gdi
+               folder unless it's a full path.
+        coalesce_gap: Files at most this many bytes apart are read at 
+                      once, then written one by one. Default: 64 KiB
+        coalesce_size: Max bytes read at once like that, 0 reads every
+                       file on its own. Default: 4 MiB
+
+        Other kwargs are passed to dump_file_by_record. Errors are 
+        reported when verbose, then raised again.
+        """
         # target has a default value not to accidentally fill dev folder 
         # Sorting according to LBA to avoid too much skipping on HDDs
 
-        if not target[0] == '/': # Paths rel. to gdi folder unless full paths
+        if not executor in ['process', 'thread']:
+            raise ValueError('Argument executor should be either '
+                             '\'process\' or \'thread\'')
+        if archive and int(workers) > 1:
+            raise ValueError('Archives are written by a single worker')
+        if archive and (incremental or checkpoint):
+            raise ValueError('Archives are always written from scratch')
+        if archive and store:
+            raise ValueError('Archives can\'t be made of links to a store')
+        if coalesce_gap < 0 or coalesce_size < 0:
+            raise ValueError('Arguments coalesce_gap and coalesce_size '
+                             'can\'t be negative')
+        if incremental and not incremental in (True,) + HASH_ALGORITHMS:
+            raise ValueError('Argument incremental should be True, False '
+                             'or one of {}'.format(', '.join(HASH_ALGORITHMS)))
+
+        if archive:
+            if not archive[0] == '/':
+                archive = self._dirname + '/' + archive
+        elif not target[0] == '/': # Paths rel. to gdi folder unless full paths
             target = self._dirname + '/' + target
+
+        # Parallel workers hash what they dump themselves
+        if manifest and int(workers) <= 1:
+            digest = _Digester(algorithms)
+        else:
+            digest = None
+        if checkpoint:
+            if not checkpoint[0] == '/':
+                checkpoint = self._dirname + '/' + checkpoint
+            checkpoint = _Checkpoint(checkpoint, target)
+        if store and not isinstance(store, ContentStore):
+            if not store[0] == '/':
+                store = self._dirname + '/' + store
+            store = ContentStore(store)
+        entries = []
+        keys, names = {}, None  # The store objects of the files
+        finished = False
         try:
-            for i in self._sorted_records(crit='ex_loc'):
-                self.dump_file_by_record(i, target = target, **kwargs)
+            plan = coalesce_gap, coalesce_size
+            if archive:
+                entries = self._dump_records_archive(archive, target, digest,
+                                                     cancel, plan, **kwargs)
+            else:
+                records = self._sorted_records(crit='ex_loc')
+                names = set(i['name'] for i in records)
+                if incremental or checkpoint:
+                    records, entries = self._skip_dumped(
+                                records, target, incremental, checkpoint,
+                                kwargs.get('keep_timestamp', True), 
+                                algorithms if manifest else None, cancel)
+
+                if int(workers) > 1:
+                    entries += self._dump_records_parallel(
+                                records, target, int(workers), executor,
+                                algorithms if manifest else None, cancel,
+                                checkpoint, store, keys, plan, **kwargs)
+                else:
+                    for i, src in self._planned_reads(records, *plan):
+                        _check_cancel(cancel)
+                        key = self.dump_file_by_record(i, target = target, 
+                                                       digest = digest, 
+                                                       store = store, 
+                                                       src = src, **kwargs)
+                        if store:
+                            keys[i['name']] = key
+                        if checkpoint:
+                            checkpoint.add(i)
+                        if digest:
+                            entries.append((i, digest.hexdigests()))
+            finished = True
 
             if self._verbose:
                 UpdateLine('All files were dumped successfully.')
@@ -296,6 +1009,254 @@ class ISO9660(_ISO9660_orig):
         except:
             if self._verbose:
                 UpdateLine('There was an error dumping all files.')
+                UpdateLine('\n')
+            raise
+        finally:
+            if digest:
+                digest.close()
+            if checkpoint:
+                checkpoint.close(remove = finished)
+            if store:
+                # The files of target that aren't in the image anymore 
+                # are only forgotten if they were all dumped
+                store.add_refs(target, keys, names if finished else None)
+
+        if manifest:
+            self.dump_manifest(entries, manifest, algorithms)
+
+
+    def _skip_dumped(self, records, target, incremental = False, 
+                     checkpoint = None, keep_timestamp = True, 
+                     algorithms = None, cancel = None):
+        """
+        Returns (records left to dump, manifest entries of the others), 
+        the others being in checkpoint or up to date in target, see 
+        dump_all_files. They're hashed from the image for the manifest
+        when algorithms isn't None.
+        """
+        todo, entries = [], []
+        digest = _Digester(algorithms, threaded = False) if algorithms else None
+        for rec in records:
+            _check_cancel(cancel)
+            filename = self._prepare_dump(rec, target)
+            if checkpoint and checkpoint.has(rec):
+                # Trusted, as long as the file wasn't truncated since
+                if not (os.path.isfile(filename) and 
+                        os.path.getsize(filename) == rec['ex_len']):
+                    todo.append(rec)
+                    continue
+            elif not incremental or not self._up_to_date(
+                            rec, filename, 
+                            self._dump_timestamp(rec, keep_timestamp),
+                            incremental):
+                todo.append(rec)
+                continue
+
+            if self._verbose:
+                UpdateLine('Up to date: {}'.format(filename))
+            if checkpoint:
+                checkpoint.add(rec)
+            if digest:
+                self._hash_record(rec, digest)
+                entries.append((rec, digest.hexdigests()))
+        return todo, entries
+
+
+    def _up_to_date(self, rec, filename, timestamp = None, 
+                    incremental = True):
+        """
+        Whether filename holds the file of rec: it has the same size, 
+        the same modification time unless timestamp is None and, when
+        incremental is one of HASH_ALGORITHMS, the same digest.
+
+        The time of hardlinks to a ContentStore isn't compared, they 
+        share the one of the store object.
+        """
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return False
+        if st.st_size != rec['ex_len']:
+            return False
+        if (timestamp is not None and st.st_nlink == 1 and 
+                abs(st.st_mtime - timestamp) >= 2):
+            return False    # Not == as FAT only stores even seconds
+        if incremental in HASH_ALGORITHMS:
+            ours, theirs = _new_hash(incremental), _new_hash(incremental)
+            self._hash_record(rec, ours)
+            with open(filename, 'rb') as f:
+                _copy_buffered(f, None, length = rec['ex_len'], 
+                               digest = theirs)
+            return ours.hexdigest() == theirs.hexdigest()
+        return True
+
+
+    def _hash_record(self, rec, digest):
+        # Feeds the data of the file of rec to digest
+        with self._io_lock:
+            self._gdifile.seek(rec['ex_loc']*2048)
+            _copy_buffered(self._gdifile, None, length = rec['ex_len'],
+                           digest = digest, stats = self._stats)
+
+
+    @_phase('hash')
+    def hash_all_files(self, manifest = None, algorithms = HASH_ALGORITHMS):
+        """
+        Hash-only mode, computes the digests of all the files without 
+        writing any of them. 
+
+        manifest: Filename the hash manifest is written to, if any
+        algorithms: Digests to compute, any of HASH_ALGORITHMS
+
+        Returns [(record, {algorithm: hexdigest}), ...]
+        """
+        entries = []
+        digest = _Digester(algorithms)
+        try:
+            for rec in self._sorted_records(crit='EX_LOC'):
+                if self._verbose:
+                    UpdateLine('Hashing {}    ({}, {})'.format(
+                                    rec['name'].split('/')[-1], 
+                                    rec['ex_loc'], rec['ex_len']))
+                self._hash_record(rec, digest)
+                entries.append((rec, digest.hexdigests()))
+        finally:
+            digest.close()
+
+        if self._verbose:
+            UpdateLine('All files were hashed successfully.')
+            UpdateLine('\n')
+        if manifest:
+            self.dump_manifest(entries, manifest, algorithms)
+        return entries
+
+
+    def get_manifest(self, entries, algorithms = HASH_ALGORITHMS):
+        """
+        entries: [(record, {algorithm: hexdigest}), ...] as returned by 
+                 hash_all_files
+
+        Returns the manifest, one line per file by increasing LBA:
+            name ex_loc ex_len digests...
+        """
+        manifest = '# name ex_loc ex_len {}\n'.format(' '.join(algorithms))
+        newline = '{name} {ex_loc} {ex_len} {digests}\n'
+        for rec, digests in sorted(entries, key = lambda k: (k[0]['ex_loc'],
+                                                             k[0]['name'])):
+            manifest += newline.format(name = rec['name'], 
+                                       ex_loc = rec['ex_loc'],
+                                       ex_len = rec['ex_len'],
+                                       digests = ' '.join(digests[i] for i 
+                                                          in algorithms))
+        return manifest
+
+
+    def dump_manifest(self, entries, filename = 'manifest.txt', 
+                      algorithms = HASH_ALGORITHMS):
+        if not filename[0] == '/': # Paths rel. to gdi folder unless full paths
+            filename = self._dirname + '/' + filename
+
+        path = os.path.dirname(filename)
+        if not os.path.exists(path):
+            os.makedirs(path)   
+            if self._verbose: 
+                message = 'Created directory: {}'
+                UpdateLine(message.format(path))
+
+        with open(filename, 'wb') as f:
+            if self._verbose: 
+                print('Dumping hash manifest to {}'.format(filename))
+            f.write(self.get_manifest(entries, algorithms))
+
+
+    def _dump_records_archive(self, archive, target, digest = None, 
+                              cancel = None, plan = (0, 0), 
+                              keep_timestamp = True):
+        # Directories first, then the files by increasing LBA. Files are
+        # streamed one buffer at a time, never loaded whole in memory.
+        path = os.path.dirname(archive)
+        if not os.path.exists(path):
+            os.makedirs(path)
+            if self._verbose: 
+                UpdateLine('Created directory: {}'.format(path))
+
+        now = time.time()
+        stamp = lambda rec: self._dump_timestamp(rec, keep_timestamp) or now
+        prefix = target.strip('/') + '/' if target.strip('/') else ''
+
+        entries = []
+        writer = _open_archive(archive)
+        try:
+            for rec in self.gen_records(get_files = False):
+                writer.add_dir(prefix + rec['name'].strip('/'), stamp(rec))
+
+            for rec, src in self._planned_reads(
+                            self._sorted_records(crit='EX_LOC'), *plan):
+                _check_cancel(cancel)
+                name = prefix + rec['name'].strip('/')
+                self._report_dump(rec, archive + ':' + name)
+                writer.add_file(name, ExtentFile(src, rec['ex_loc'],
+                                                 rec['ex_len'], 
+                                                 lock = self._io_lock,
+                                                 digest = digest),
+                                rec['ex_len'], stamp(rec))
+                if self._stats is not None:
+                    self._stats.bytes_written += rec['ex_len']
+                if digest:
+                    entries.append((rec, digest.hexdigests()))
+        finally:
+            writer.close()
+        return entries
+
+
+    def _dump_records_parallel(self, records, target, workers, executor,
+                               algorithms = None, cancel = None, 
+                               checkpoint = None, store = None, keys = None,
+                               plan = (0, 0), keep_timestamp = True):
+        # Directories are created here, before any worker gets to them, 
+        # so they never race on os.makedirs.
+        files, filenames = [], {}
+        for rec in records:
+            filename = self._prepare_dump(rec, target)
+            if rec['flags'] != 2:
+                files.append(rec)
+                filenames[rec['name']] = filename
+
+        # A job per run of _plan_reads, its files come back together
+        runs, jobs = [], []
+        for start, length, recs in _plan_reads(files, *plan):
+            runs.append(recs)
+            jobs.append((start, length, 
+                         [(rec['ex_loc'], rec['ex_len'], filenames[rec['name']],
+                           self._dump_timestamp(rec, keep_timestamp))
+                          for rec in recs], algorithms, store))
+
+        Pool = ThreadPool if executor == 'thread' else multiprocessing.Pool
+        pool = Pool(workers, _init_dump_worker, 
+                    (self._dict1, self._dict2, self._stats is not None))
+        entries = []
+        try:
+            # imap keeps the LBA order, so reports come out as in serial
+            for recs, (results, stats) in izip(runs, 
+                                      pool.imap(_dump_extent_job, jobs, 4)):
+                if stats:
+                    self._stats.merge(stats)
+                for rec, (filename, digests, key) in izip(recs, results):
+                    _check_cancel(cancel)   # Terminates the pool below
+                    self._report_dump(rec, filename)
+                    if checkpoint:
+                        checkpoint.add(rec)
+                    if key:
+                        keys[rec['name']] = key
+                    if digests:
+                        entries.append((rec, digests))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return entries
 
 
     def get_time_by_record(self, rec):
@@ -331,12 +1292,27 @@ class GDIfile(ISO9660):
 
     Boolean kwarg *verbose* enables printing infos on what's going on.
 
+    Boolean kwarg *cache* keeps the parsed filesystem in a file next to 
+    the gdi file so the next runs don't have to read it from the tracks
+    again. *cache_dir* puts these files in another folder instead.
+
+    Kwargs *cache_blocks*, *block_sectors* and *cache_bypass* tune the
+    sectors cache used to read the filesystem, see AppendedFiles.
+
+    Boolean kwarg *stats* counts the seeks, reads & writes and times the
+    parse, walk, extract and hash phases, see IOStats, io_stats and 
+    print_io_stats. It costs next to nothing when disabled.
+
     e.g.
     gdi = gdifile('disc.gdi')
     gdi.dump_all_files()
     """
     def __init__(self, filename, **kwargs): # Isn't OO programming wonderful?
         verbose = kwargs['verbose'] if kwargs.has_key('verbose') else False 
+        cache = kwargs.pop('cache', False)
+        cache_dir = kwargs.pop('cache_dir', None)
+        if cache or cache_dir:
+            kwargs['cachefile'] = cache_filename(filename, cache_dir)
         ISO9660.__init__(self, *parse_gdi(filename, verbose=verbose), **kwargs)
 
     def __enter__(self):
@@ -348,14 +1324,228 @@ class GDIfile(ISO9660):
 
 
 
+class CancelledError(Exception):
+    """
+    Raised by the operations of a GDIPool that were cancelled.
+    """
+
+
+def _check_cancel(cancel):
+    if cancel is not None and cancel.is_set():
+        raise CancelledError('Cancelled')
+
+
+class Task(object):
+    """
+    An operation running on the threads of a GDIPool. get() waits for 
+    its result, raising its error if it failed, and cancel() asks it to
+    stop: it won't start if it didn't, and dumps stop before their next
+    file. Either way, get() then raises CancelledError.
+    """
+    def __init__(self, pool, func, args = (), kwargs = {}, cancelled = None):
+        self.cancelled = cancelled or threading.Event()
+        self._result = pool.apply_async(self._run, (func, args, kwargs))
+
+    def _run(self, func, args, kwargs):
+        _check_cancel(self.cancelled)
+        return func(*args, **kwargs)
+
+    def get(self, timeout = None):
+        return self._result.get(timeout)
+
+    def ready(self):
+        return self._result.ready()
+
+    def wait(self, timeout = None):
+        self._result.wait(timeout)
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class TaskIterator(Task):
+    """
+    A Task yielding the items of an iterator as a thread of the pool 
+    produces them, at most queue_size ahead of the consumer so a slow 
+    one holds the reads back. Errors are raised when reaching them.
+
+    cancel() frees the producing thread, then get() or iterating raise
+    CancelledError. It's cancelled as well once it's dropped, so 
+    breaking out of a loop over it never leaves the thread waiting.
+    """
+    def __init__(self, pool, func, args = (), kwargs = {}, queue_size = 8):
+        self.cancelled = threading.Event()
+        self._queue = Queue.Queue(queue_size)
+        self._finished = False
+        # The producer doesn't hold self, or it would never be dropped
+        self._result = pool.apply_async(_produce, (self._queue, 
+                                        self.cancelled, func, args, kwargs))
+
+    def __del__(self):
+        self.cancel()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        _check_cancel(self.cancelled)
+        if self._finished:
+            raise StopIteration
+        ok, item = self._queue.get()
+        if ok:
+            return item
+        self._finished = True
+        if ok is None:
+            raise StopIteration
+        raise item[0], item[1], item[2]
+
+    def cancel(self):
+        Task.cancel(self)
+        # Makes room for the producer, so it sees it's cancelled
+        try:
+            while True:
+                self._queue.get_nowait()
+        except Queue.Empty:
+            pass
+
+
+def _produce(queue, cancelled, func, args, kwargs):
+    # Producer of a TaskIterator. It never waits on a full queue for 
+    # long, so it sees it was cancelled even if nothing consumes it.
+    def put(item):
+        while True:
+            _check_cancel(cancelled)
+            try:
+                queue.put(item, timeout = 0.1)
+                return
+            except Queue.Full:
+                pass
+
+    _check_cancel(cancelled)
+    try:
+        for item in func(*args, **kwargs):
+            put((True, item))
+    except CancelledError:
+        raise
+    except Exception:
+        put((False, sys.exc_info()))
+        raise
+    put((None, None))   # Done
+
+
+class GDIPool(object):
+    """
+    Runs GDIfile operations on many images at once without blocking the
+    caller, with a bounded number of threads doing the track reads.
+    Each operation returns a Task, or a TaskIterator for those yielding
+    records or file data.
+
+    threads: Operations running at once, an iterator waiting on its 
+             consumer holds one. Default: 4
+    queue_size: Items an iterator produces ahead. Default: 8
+
+    e.g.
+    with GDIPool() as pool:
+        opening = [pool.open(i) for i in filenames]
+        dumps = [pool.dump_all_files(i.get(), target = 'data') 
+                 for i in opening]
+        for i in dumps:
+            i.get()
+    """
+    def __init__(self, threads = 4, queue_size = 8):
+        self._pool = ThreadPool(threads)
+        self._queue_size = queue_size
+        self._iterators = weakref.WeakSet()    # Cancelled on close
+
+    def _iterate(self, func, args = ()):
+        task = TaskIterator(self._pool, func, args, 
+                            queue_size = self._queue_size)
+        self._iterators.add(task)
+        return task
+
+    def open(self, filename, **kwargs):
+        """
+        Task opening filename, its result is the GDIfile. kwargs are 
+        those of GDIfile.
+        """
+        return Task(self._pool, GDIfile, (filename,), kwargs)
+
+    def gen_records(self, gdi, files = True, dirs = True):
+        """
+        TaskIterator of the records of gdi, see walk_records.
+        """
+        return self._iterate(gdi.walk_records, (files, dirs))
+
+    def get_file_by_record(self, gdi, rec, bufsize = 1*1024*1024):
+        """
+        TaskIterator of the data of the file of record rec, bufsize 
+        bytes at a time.
+        """
+        def chunks():
+            with gdi.open_record(rec) as f:
+                for i in xrange(0, rec['ex_len'], bufsize):
+                    yield f.read(bufsize)
+        return self._iterate(chunks)
+
+    def dump_all_files(self, gdi, **kwargs):
+        """
+        Task dumping all the files of gdi, kwargs are those of 
+        GDIfile.dump_all_files. Other operations on gdi can run 
+        meanwhile, the dump only holds the image for each read.
+        """
+        cancel = threading.Event()
+        kwargs['cancel'] = cancel
+        return Task(self._pool, gdi.dump_all_files, (), kwargs, cancel)
+
+    def _cancel_iterators(self):
+        # Whatever still iterates is done once the pool is closed, and 
+        # an iterator left waiting would hold its thread forever
+        for i in list(self._iterators):
+            i.cancel()
+
+    def close(self):
+        # Waits for the running operations, iterators aside
+        self._cancel_iterators()
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        # Doesn't wait, unlike close
+        self._cancel_iterators()
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type=None, value=None, traceback=None):
+        if type is None:
+            self.close()
+        else:
+            self.terminate()
+        
+
+
 
 class CdImage(file):
     """
     Class that allows opening a 2352 or 2048 bytes/sector data cd track
     as a 2048 bytes/sector one.
+
+    2352 bytes/sector tracks are memory-mapped unless *use_mmap* is 
+    False, so reads slice the user data straight out of the map instead
+    of copying the raw sectors around first.
+
+    Tracks packed by pack_track are read through a PackedTrack, which 
+    only decompresses the blocks that are read. *packed_cache* is the 
+    number of decompressed blocks it keeps. Default: 8
     """
     def __init__(self, filename, mode = 'auto', *args, **kwargs):
 
+        header = _packed_header(filename)
+        if mode == 'auto' and header and header['sector_size']:
+            mode = header['sector_size']
+
         if mode == 'auto':
             if filename[-4:] == '.iso': mode = 2048
             elif filename[-4:] == '.bin': mode = 2352
@@ -367,23 +1557,68 @@ class CdImage(file):
         if (len(args) > 0) and (args[0] not in ['r','rb']):
             raise NotImplementedError('Only read mode is implemented.')
 
+        if kwargs.has_key('use_mmap'):
+            use_mmap = kwargs.pop('use_mmap')
+        else:
+            use_mmap = True
+
+        self._stats = kwargs.pop('stats', None)    # IOStats, if any
+        packed_cache = kwargs.pop('packed_cache', 8)
+
         file.__init__(self, filename, 'rb')
 
-        file.seek(self,0,2)
+        self._packed = None
+        if header:
+            self._packed = PackedTrack(filename, cache_blocks = packed_cache)
+
+        self._raw_seek(0,2)
         if self.__mode == 2352:
-            self.length = file.tell(self) * 2048/2352
+            self.length = self._raw_tell() * 2048/2352
         else:
-            self.length = file.tell(self)
-        file.seek(self,0,0)
+            self.length = self._raw_tell()
+        self._raw_seek(0,0)
+
+        self._map = None
+        if use_mmap and self.__mode == 2352 and not self._packed:
+            try:
+                self._map = mmap.mmap(self.fileno(), 0, 
+                                      access = mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                pass    # Empty or unmappable file, plain reads it is
 
         self.seek(0)
 
+    @property
+    def sector_size(self):
+        return self.__mode
+
+    @property
+    def packed(self):
+        return self._packed is not None
+
+    # The stored bytes of the track, packed or not
+    def _raw_seek(self, a, b = 0):
+        if self._packed is None:
+            file.seek(self, a, b)
+        else:
+            self._packed.seek(a, b)
+
+    def _raw_read(self, length = None):
+        if self._packed is None:
+            return file.read(self) if length is None else file.read(self, length)
+        return self._packed.read(length)
+
+    def _raw_tell(self):
+        if self._packed is None:
+            return file.tell(self)
+        return self._packed.tell()
+
     def realOffset(self,a):
         return a/2048*2352 + a%2048 + 16
 
     def seek(self, a, b = 0):
         if self.__mode == 2048:
-            file.seek(self, a, b)
+            self._raw_seek(a, b)
 
         elif self.__mode == 2352:
             if b == 0:
@@ -393,46 +1628,79 @@ class CdImage(file):
             if b == 2:
                 self.binpointer = self.length - a
 
-            realpointer = self.realOffset(self.binpointer)
-            file.seek(self, realpointer, 0)
+            if self._map is None:
+                realpointer = self.realOffset(self.binpointer)
+                self._raw_seek(realpointer, 0)
 
     def read(self, length = None):
         if self.__mode == 2048:
-            return file.read(self, length)
+            if self._stats is None:
+                return self._raw_read(length)
+            start = self._raw_tell()
+            data = self._raw_read(length)
+            self._stats.add_read(self.name, start, len(data), len(data))
+            return data
 
         elif self.__mode == 2352:
             if length == None:
                 length = self.length - self.binpointer
 
-            # Amount of bytes left until beginning of next sector
-            tmp = 2048 - self.binpointer % 2048    
             FutureOffset = self.binpointer + length
-            realLength = self.realOffset(FutureOffset) - \
-                            self.realOffset(self.binpointer)
-            # This will (hopefully) accelerates readings on HDDs at the
-            # cost of more memory use.
-            buff = StringIO(file.read(self, realLength)) 
-            # The first read can be < 2048 bytes
-            data = buff.read(tmp)
-            length -= tmp
-            buff.seek(304, 1)
-            # The middle reads are all 2048 so we optimize here!
-            for i in xrange(length / 2048):
-                data += buff.read(2048)
-                buff.seek(304, 1)
-            # The last read can be < 2048 bytes
-            data += buff.read(length % 2048)
+            data = self._deinterleave(self.binpointer, FutureOffset)
             # Seek back to where we should be
             self.seek(FutureOffset)
             return data
 
+    def _deinterleave(self, start, end):
+        """
+        Returns the user data found between offsets *start* and *end* 
+        of the 2048 bytes/sector view, skipping sync, header, EDC & ECC.
+        """
+        first, last = start / 2048, (end + 2047) / 2048
+        if last <= first:
+            return ''
+        if self._stats is not None:
+            self._stats.add_read(self.name, first*2352, end - start, 
+                                 (last - first)*2352)
+            self._stats.sectors_decoded += last - first
+
+        if self._map is not None:
+            raw, base = self._map, 0
+        else:
+            # One read for the whole span, it's kinder to HDDs.
+            base = first * 2352
+            self._raw_seek(base, 0)
+            raw = self._raw_read((last - first) * 2352)
+
+        # One slice per sector and a single join, no growing strings.
+        chunks = [raw[i:i+2048] for i in 
+                  xrange(first*2352 + 16 - base, last*2352 - base, 2352)]
+        if not chunks:
+            return ''
+
+        # The first and last sectors can be partially read
+        chunks[-1] = chunks[-1][:end - (last - 1)*2048]
+        chunks[0] = chunks[0][start % 2048:]
+        return ''.join(chunks)
+
     def tell(self):
         if self.__mode == 2048:
-            return file.tell(self)
+            return self._raw_tell()
 
         elif self.__mode == 2352:
             return self.binpointer
 
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._packed is not None:
+            self._packed.close()
+        file.close(self)
+
+    def __exit__(self, type=None, value=None, traceback=None):
+        self.close()
+
 
 
 class OffsetedFile(CdImage):
@@ -487,9 +1755,13 @@ class OffsetedFile(CdImage):
         elif FutureOffset < self.offset:
             #print 'BEFORE OFFSET'
             data = '\x00'*length
+            if self._stats is not None:
+                self._stats.padding_bytes += length
         else:
             #print 'CROSSING OFFSET'
             preData = '\x00'*(self.offset - tmp)
+            if self._stats is not None:
+                self._stats.padding_bytes += len(preData)
             self.seek(self.offset)
             postData = CdImage.read(self, FutureOffset - self.offset)
             data = preData + postData
@@ -501,6 +1773,16 @@ class OffsetedFile(CdImage):
         return self.pointer
 
 
+    def segments(self):
+        """
+        Returns how the file is made, as [(start, end, track, 
+        track_offset), ...] by increasing offset: bytes start to end 
+        come from track's (2048 bytes/sector) offset track_offset, or 
+        are padding when track is None.
+        """
+        return _track_segments(self.name, self.offset, self.length)
+
+
 
 class WormHoleFile(OffsetedFile):
     """
@@ -575,11 +1857,11 @@ class WormHoleFile(OffsetedFile):
             inWorm_len = self.wormlen
             postWorm_len = FutureOffset - self.target - self.wormlen
 
-            preWorm = OffsetedFile.read(preWorm_len)
+            preWorm = OffsetedFile.read(self, preWorm_len)
             self.seek(self.source)
-            inWorm = OffsetedFile.read(inWorm_len)
+            inWorm = OffsetedFile.read(self, inWorm_len)
             self.seek(self.target + inWorm_len)
-            postWorm = OffsetedFile.read(postWorm_len)
+            postWorm = OffsetedFile.read(self, postWorm_len)
 
             data = preWorm + inWorm + postWorm
         
@@ -590,35 +1872,61 @@ class WormHoleFile(OffsetedFile):
         return data
 
 
+    def segments(self):
+        # Those of the OffsetedFile, with the source of the wormhole 
+        # showing through it
+        return _wormhole_segments(OffsetedFile.segments(self), 
+                                  self.offset + self.length, self.target,
+                                  self.source, self.wormlen)
+
+
 
 class AppendedFiles():
     """
-    Two WormHoleFiles one after another. 
-    Takes 1 or 2 dict(s) as arguments; they're passed to WormHoleFiles'
-    at the init.
+    The tracks of 1 or 2 dict(s) of parse_gdi one after another, each 
+    one offsetted and with its wormhole like a WormHoleFile would be.
 
     This is aimed at merging the TOC track starting at LBA45000 with 
     the last one to mimic one big track at LBA0 with the files at the 
     same LBA than the GD-ROM.
-    """
-    def __init__(self, wormfile1, wormfile2 =  None, *args, **kwargs):
 
-        self._f1 = WormHoleFile(**wormfile1)
+    Reads go through the segments of extent_map: each contiguous part 
+    of a track is read from its CdImage at once, padding is made here.
 
-        self._f1.seek(0,2)
-        self._f1_len = self._f1.tell()
-        self._f1.seek(0,0)
+    read_cached() keeps the last blocks it read in a LRU cache, for the
+    small and repetitive filesystem reads. Its kwargs are:
 
-        self._f2_len = 0
-        if wormfile2:
-            self._f2 = WormHoleFile(**wormfile2)
+        cache_blocks: Max number of blocks in the cache, 0 disables it.
+                      Default: 256
+        block_sectors: Sectors per block. Default: 8
+        cache_bypass: Reads larger than this many bytes skip the cache
+                      so they don't flush it. Default: 256 KiB
+    """
+    def __init__(self, wormfile1, wormfile2 =  None, *args, **kwargs):
 
-            self._f2.seek(0,2)
-            self._f2_len = self._f2.tell()
-            self._f2.seek(0,0)
-        else:
-            # So the rest of the code works for one or 2 files.
-            self._f2 = StringIO('') 
+        # IOStats passed on to the tracks, if any
+        self.stats = kwargs.pop('stats', None)
+        self._cache_blocks = kwargs.pop('cache_blocks', 256)
+        self._block_size = kwargs.pop('block_sectors', 8) * 2048
+        self._cache_bypass = kwargs.pop('cache_bypass', 256*1024)
+        self._cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        dicts = [i for i in [wormfile1, wormfile2] if i]
+        self._segments = extent_map(*dicts)
+        self._starts = [i[0] for i in self._segments]
+        self._length = self._segments[-1][1] if self._segments else 0
+        self._tracks = {}
+        try:
+            for d in dicts:
+                self._tracks[d['filename']] = CdImage(
+                                d['filename'], d.get('mode', 'auto'),
+                                use_mmap = d.get('use_mmap', True),
+                                stats = self.stats)
+        except:
+            self.__exit__()
+            raise
 
         self.seek(0,0)
 
@@ -629,32 +1937,111 @@ class AppendedFiles():
         if b == 1:
             self.MetaPointer += a
         if b == 2:
-            self.MetaPointer = self._f1_len + self._f2_len - a
-
-        if self.MetaPointer >= self._f1_len:
-            self._f1.seek(0, 2)
-            self._f2.seek(a - self._f1_len, 0)
-        else:
-            self._f1.seek(a, 0)
-            self._f2.seek(0, 0)
+            self.MetaPointer = self._length - a
 
 
     def read(self, length = None):
+        start = self.MetaPointer
+        end = self._length if length == None else start + length
+        end = max(start, min(end, self._length))
+
+        # One read per segment, most of the time there's just one
+        chunks = []
+        i = bisect.bisect_right(self._starts, start) - 1
+        pos = start
+        while pos < end:
+            a, b, track, offset = self._segments[i]
+            n = min(b, end) - pos
+            if track is None:
+                chunks.append('\x00'*n)
+                if self.stats is not None:
+                    self.stats.padding_bytes += n
+            else:
+                f = self._tracks[track]
+                f.seek(offset + pos - a)
+                chunks.append(f.read(n))
+            pos += n
+            i += 1
+
+        self.MetaPointer = end
+        return chunks[0] if len(chunks) == 1 else ''.join(chunks)
+
+
+    def read_cached(self, length = None):
+        """
+        Like read, but served from the blocks cache when possible.
+        """
         if length == None:
-            length = self._f1_len + self._f2_len - self.MetaPointer
-        tmp = self.MetaPointer
-        FutureOffset = self.MetaPointer + length
-        if FutureOffset < self._f1_len: # Read inside file1
-            data = self._f1.read(length)
-        elif tmp > self._f1_len:        # Read inside file2
-            data = self._f2.read(length)
-        else:                           # Read end of file1 and start of file2
-            data = self._f1.read(self._f1_len - tmp)
-            data += self._f2.read(FutureOffset - self._f1_len)
-
-        self.seek(FutureOffset) # It might be enough to just update 
-                                # self.MetaPointer, but this is safer.
+            length = self._length - self.MetaPointer
+        if not self._cache_blocks or length > self._cache_bypass:
+            return self.read(length)
+
+        start = self.MetaPointer
+        first = start / self._block_size
+        last = (start + length - 1) / self._block_size
+        data = ''.join([self._get_block(i) for i in xrange(first, last + 1)])
+        offset = start - first * self._block_size
+        data = data[offset:offset + length]
+
+        self.seek(start + length)
         return data
+
+
+    def _get_block(self, num):
+        # OrderedDict as a LRU: hits are moved to the end, the first one
+        # is the least recently used.
+        if self._cache.has_key(num):
+            self.cache_hits += 1
+            data = self._cache.pop(num)
+        else:
+            self.cache_misses += 1
+            self.seek(num * self._block_size)
+            data = self.read(self._block_size)
+            if len(self._cache) >= self._cache_blocks:
+                self._cache.popitem(last = False)
+        self._cache[num] = data
+        return data
+
+
+    def segments(self):
+        """
+        Returns how the appended files are made, see extent_map.
+        """
+        return list(self._segments)
+
+
+    def track_of(self, start):
+        """
+        Returns the filename of the track holding the byte at start,
+        None if it's padding.
+        """
+        i = bisect.bisect_right(self._starts, start) - 1
+        if i < 0 or start >= self._length:
+            return None
+        return self._segments[i][2]
+
+
+    def physical_extent(self, start, length):
+        """
+        Returns (track, offset) when the length bytes at start are 
+        stored as is at offset of track, an opened 2048 bytes/sector 
+        CdImage that isn't packed. Returns None otherwise.
+        """
+        i = bisect.bisect_right(self._starts, start) - 1
+        if i < 0 or start >= self._length:
+            return None
+        a, b, track, offset = self._segments[i]
+        if (track is None or start + length > b or 
+                self._tracks[track].sector_size != 2048 or
+                self._tracks[track].packed):
+            return None
+        return self._tracks[track], offset + start - a
+
+
+    def cache_info(self):
+        return dict(hits = self.cache_hits, misses = self.cache_misses,
+                    blocks = len(self._cache), max_blocks = self._cache_blocks,
+                    block_size = self._block_size)
             
 
     def tell(self):
@@ -669,12 +2056,76 @@ class AppendedFiles():
         # This is required to close files properly when using the with
         # statement. Which isn't required by ISO9660 anymore, but could
         # be useful for other uses so it stays!
-        self._f1.__exit__()
-        if self._f2_len:
-            self._f2.__exit__()
+        for i in self._tracks.values():
+            i.__exit__()
 
 
 
+def extent_map(*tracks):
+    """
+    Returns the table of the tracks, dicts of parse_gdi, appended one 
+    after another with their offset and wormhole: [(start, end, track,
+    track_offset), ...] by increasing offset. Bytes start to end come 
+    from the 2048 bytes/sector view of track (its filename) at 
+    track_offset, or are padding when track is None. 
+
+    Segments are contiguous: what a track shorter than its wormhole 
+    leaves is padding too, and consecutive parts of a track or of the 
+    padding are merged.
+    """
+    segments, base = [], 0
+    for d in tracks:
+        size = get_filesize(d['filename'])
+        length = size * 2048/2352 if d.get('mode') == 2352 else size
+        offset = d.get('offset', 0)
+        end = offset + length
+        track = _track_segments(d['filename'], offset, length)
+        if d.get('wormhole') and d['wormhole'][2]:
+            track = _wormhole_segments(track, end, *d['wormhole'])
+        segments += _cut_segments(track, 0, end, base)
+        base += end
+
+    ret = []
+    for i in segments:
+        if ret and i[0] > ret[-1][1]:
+            ret.append((ret[-1][1], i[0], None, 0))
+        j = ret[-1] if ret else None
+        if j and i[2] == j[2] and (i[2] is None or i[3] == j[3] + j[1] - j[0]):
+            ret[-1] = (j[0], i[1], j[2], j[3])
+        else:
+            ret.append(i)
+    return ret
+
+
+def _track_segments(track, offset, length):
+    # A track of length bytes after offset bytes of padding
+    return [i for i in [(0, offset, None, 0), 
+                        (offset, offset + length, track, 0)] if i[1] > i[0]]
+
+
+def _wormhole_segments(segments, end, target, source, wormlen):
+    # The source of the wormhole showing through its target
+    return (_cut_segments(segments, 0, target) +
+            _cut_segments(segments, source, source + wormlen, 
+                          target - source) +
+            _cut_segments(segments, target + wormlen, end))
+
+
+def _cut_segments(segments, start, end, shift = 0):
+    """
+    Returns the parts of segments (see OffsetedFile.segments) between 
+    offsets start and end, moved by shift.
+    """
+    ret = []
+    for a, b, track, offset in segments:
+        a2, b2 = max(a, start), min(b, end)
+        if b2 > a2:
+            if track is not None:
+                offset += a2 - a
+            ret.append((a2 + shift, b2 + shift, track, offset))
+    return ret
+
+
 def parse_gdi(filename, verbose = False):
     filename = os.path.realpath(filename)
     dirname = os.path.dirname(filename)
@@ -719,12 +2170,974 @@ def parse_gdi(filename, verbose = False):
     return ret
 
 
+def cache_filename(filename, cache_dir = None):
+    """
+    Returns where the filesystem cache of a gdi file is kept: next to it
+    by default, or in cache_dir under a name unique to the gdi path.
+    """
+    filename = os.path.realpath(filename)
+    if cache_dir is None:
+        return filename + '.cache'
+    return os.path.join(cache_dir, '{}-{}.cache'.format(
+            os.path.basename(filename), md5(filename).hexdigest()[:12]))
+
+
+def _from_json(obj):
+    """
+    Returns obj as loaded by json, with its strings back to the bytes 
+    they were dumped from with encoding = 'latin-1'.
+    """
+    if isinstance(obj, unicode):
+        return obj.encode('latin-1')
+    if isinstance(obj, list):
+        return [_from_json(i) for i in obj]
+    if isinstance(obj, dict):
+        return dict((_from_json(i), _from_json(j)) for i, j in obj.items())
+    return obj
+
+
 def get_filesize(filename):
+    # The unpacked size of packed tracks
+    header = _packed_header(filename)
+    if header:
+        return header['size']
     with open(filename) as f:
         f.seek(0,2)
         return f.tell()
 
 
+### Packed tracks: the track cut in blocks of whole sectors, each one 
+### compressed on its own, followed by the offsets of the blocks so 
+### any of them can be found and decompressed alone.
+
+_PACKED_MAGIC = 'GDZ\x1a'
+_PACKED_HEADER = struct.Struct('<4sBBHIQQ')
+# Codec ids, as stored in the header: (name, compress, decompress)
+_PACKED_CODECS = [
+    ('zlib', lambda d, l: zlib.compress(d, 6 if l is None else l),
+             zlib.decompress)]
+if bz2:
+    _PACKED_CODECS.append(
+        ('bz2', lambda d, l: bz2.compress(d, 9 if l is None else l),
+                bz2.decompress))
+if lzma:
+    _PACKED_CODECS.append(
+        ('lzma', lambda d, l: lzma.compress(d, 
+                                            preset = 6 if l is None else l),
+                 lzma.decompress))
+PACKED_CODECS = tuple(i[0] for i in _PACKED_CODECS)
+# Ids are fixed even when a codec isn't available
+_PACKED_CODEC_IDS = {'zlib': 0, 'bz2': 1, 'lzma': 2}
+
+
+def _packed_header(filename):
+    """
+    Returns the header of a packed track as a dict, None if filename 
+    isn't one.
+    """
+    with open(filename, 'rb') as f:
+        data = f.read(_PACKED_HEADER.size)
+    if len(data) < _PACKED_HEADER.size or data[:4] != _PACKED_MAGIC:
+        return None
+    magic, version, codec, sector_size, block_size, size, index = \
+                                            _PACKED_HEADER.unpack(data)
+    if version != 1:
+        raise NotImplementedError('Packed track version {} of {}'.format(
+                                  version, filename))
+    return dict(codec = codec, sector_size = sector_size, 
+                block_size = block_size, size = size, index = index)
+
+
+def is_packed(filename):
+    return _packed_header(filename) is not None
+
+
+def _packed_codec(codec):
+    # (compress, decompress) of a codec, by name or id
+    for name, compress, decompress in _PACKED_CODECS:
+        if codec in [name, _PACKED_CODEC_IDS[name]]:
+            return compress, decompress
+    raise ValueError('Unsupported codec: {} (available: {})'.format(
+                     codec, ', '.join(PACKED_CODECS)))
+
+
+class PackedTrack(object):
+    """
+    Read-only file object of the original bytes of a track packed by 
+    pack_track. A read only decompresses the blocks it covers, the 
+    *cache_blocks* last ones are kept.
+    """
+    def __init__(self, filename, cache_blocks = 8):
+        header = _packed_header(filename)
+        if header is None:
+            raise ValueError('Not a packed track: {}'.format(filename))
+        self.name = filename
+        self.size = header['size']
+        self.sector_size = header['sector_size']
+        self.block_size = header['block_size']
+        self._decompress = _packed_codec(header['codec'])[1]
+        self._cache_blocks = cache_blocks
+        self._cache = OrderedDict()
+        self.blocks_decoded = 0
+
+        count = (self.size + self.block_size - 1) / self.block_size
+        self._f = open(filename, 'rb')
+        self._f.seek(header['index'])
+        data = self._f.read(8*(count + 1))
+        if len(data) != 8*(count + 1):
+            self._f.close()
+            raise ValueError('Truncated packed track: {}'.format(filename))
+        self._index = struct.unpack('<{}Q'.format(count + 1), data)
+        self.pointer = 0
+
+    def seek(self, a, b = 0):
+        if b == 0:
+            self.pointer = a
+        if b == 1:
+            self.pointer += a
+        if b == 2:
+            self.pointer = self.size - a
+
+    def read(self, length = None):
+        start = min(self.pointer, self.size)
+        end = self.size if length is None else min(start + length, self.size)
+        if end <= start:
+            return ''
+        first, last = start / self.block_size, (end - 1) / self.block_size
+        data = ''.join([self._block(i) for i in xrange(first, last + 1)])
+        offset = start - first * self.block_size
+        self.pointer = end
+        return data[offset:offset + end - start]
+
+    def _block(self, num):
+        # Same LRU as AppendedFiles
+        if self._cache.has_key(num):
+            data = self._cache.pop(num)
+        else:
+            self._f.seek(self._index[num])
+            data = self._decompress(self._f.read(self._index[num + 1] - 
+                                                 self._index[num]))
+            self.blocks_decoded += 1
+            if not self._cache_blocks:
+                return data
+            if len(self._cache) >= self._cache_blocks:
+                self._cache.popitem(last = False)
+        self._cache[num] = data
+        return data
+
+    def tell(self):
+        return self.pointer
+
+    def close(self):
+        self._f.close()
+        self._cache.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type=None, value=None, traceback=None):
+        self.close()
+
+
+def pack_track(ifile, ofile, codec = 'zlib', level = None, 
+               block_sectors = 16, sector_size = 'auto'):
+    """
+    Packs the track ifile into ofile, see PackedTrack. Returns the size 
+    of ofile.
+
+    codec: One of PACKED_CODECS
+    level: Compression level of the codec, its default if None
+    block_sectors: Sectors per block. Larger blocks pack better, smaller
+                   ones are quicker to read a few sectors from.
+    sector_size: 2048 or 2352, from the extension of ifile by default
+    """
+    compress = _packed_codec(codec)[0]
+    if sector_size == 'auto':
+        sector_size = 2048 if ifile.lower().endswith('.iso') else 2352
+    elif not sector_size in [2048, 2352]:
+        raise ValueError('Argument sector_size should be either 2048 or 2352')
+    block_size = int(block_sectors) * sector_size
+
+    size = get_filesize(ifile)
+    index = []
+    with open(ifile, 'rb') as f1, open(ofile + '.tmp', 'wb') as f2:
+        f2.write('\x00' * _PACKED_HEADER.size)   # Once the index is known
+        while True:
+            data = f1.read(block_size)
+            if not data:
+                break
+            index.append(f2.tell())
+            f2.write(compress(data, level))
+        index.append(f2.tell())
+        f2.write(struct.pack('<{}Q'.format(len(index)), *index))
+        f2.seek(0)
+        f2.write(_PACKED_HEADER.pack(_PACKED_MAGIC, 1, 
+                                     _PACKED_CODEC_IDS[codec], sector_size,
+                                     block_size, size, index[-1]))
+        f2.seek(0, 2)
+        packed = f2.tell()
+    if os.path.exists(ofile): # os.rename won't on Windows
+        os.remove(ofile)
+    os.rename(ofile + '.tmp', ofile)
+    return packed
+
+
+def unpack_track(ifile, ofile):
+    """
+    Writes the original track of the packed track ifile to ofile.
+    Returns its size.
+    """
+    with PackedTrack(ifile, cache_blocks = 0) as f1:
+        with open(ofile, 'wb') as f2:
+            return _copy_buffered(f1, f2, f1.size, closeOut = False)
+
+
+# Precompiled decoding of the filesystem structures. Both-endian fields
+# are only decoded from their little-endian half.
+_DIR_RECORD = struct.Struct('<BxI4xI4x7sBBBh2xB')
+_PATH_ENTRY = struct.Struct('<BBIH')
+_PVD_HEAD = struct.Struct('<x5sBx32s32s8xi4x32xh2xh2xh2xi4xii')
+_PVD_M = struct.Struct('>ii')
+_PVD_TAIL = struct.Struct('<128s128s128s128s38s36s37s17s17s17s17sB')
+
+_RECORD_DATE = struct.Struct('<6Bb')
+
+def _record_date(date):
+    # (seconds since the epoch, ISO 8601 string) of the 7 bytes date of
+    # a directory record, skipping datetime. The timestamp is None for 
+    # invalid dates.
+    t = _RECORD_DATE.unpack(date)
+    offset = t[6]*15    # From GMT, in minutes
+    text = '{:04}-{:02}-{:02}T{:02}:{:02}:{:02}{}{:02}:{:02}'.format(
+            t[0] + 1900, t[1], t[2], t[3], t[4], t[5], 
+            '-' if offset < 0 else '+', abs(offset)/60, abs(offset)%60)
+    if not (1 <= t[1] <= 12 and 1 <= t[2] <= 31 and t[3] < 24 and 
+            t[4] < 60 and t[5] < 60):
+        return None, text
+    return (calendar.timegm((t[0] + 1900,) + t[1:6]) - offset*60, text)
+
+
+def _unpack_dir_record(data, pos):
+    """
+    Decodes the directory record at data[pos:] into a dict, like 
+    _ISO9660_orig._unpack_record. Returns (record length, record)
+    """
+    (l0, ex_loc, ex_len, date, flags, unit_size, gap_size, volume_sequence,
+     l2) = _DIR_RECORD.unpack_from(data, pos)
+    name = data[pos + 33:pos + 33 + l2].rstrip(' ').split(';')[0]
+    if name == '\x00':
+        name = ''
+    return l0, Record(ex_loc, ex_len, date, flags, unit_size, gap_size,
+                      volume_sequence, name)
+
+
+def _dump_extent(src, ex_loc, ex_len, filename, timestamp = None, 
+                 digest = None, store = None, lock = None):
+    """
+    Copies ex_len bytes at sector ex_loc of src into filename, then sets
+    its access and modification times to timestamp unless it's None.
+    The data is also fed to digest, unless it's None. Every read of src
+    holds lock, if any, so others can share src meanwhile.
+
+    With a ContentStore as store, the data goes in it and filename is
+    made a link to it, whose key is returned. Returns None otherwise.
+    Hardlinks to the store keep its time, which other images share.
+    """
+    if os.path.isfile(filename) and os.stat(filename).st_nlink > 1:
+        # Maybe linked to a store, which must not be written through
+        os.remove(filename)
+
+    key = None
+    extent = ExtentFile(src, ex_loc, ex_len, lock = lock)
+    if store is not None:
+        key = store.add(extent, ex_len, digest)
+        store.materialize(key, filename)
+    else:
+        with open(filename, 'wb') as f:
+            # Digests need the data in python, so they skip the kernel copy
+            # (which doesn't move the position of src, no lock needed)
+            if digest is not None or not _copy_physical(src, ex_loc*2048, 
+                                                        ex_len, f):
+                _copy_buffered(extent, f, length = ex_len, digest = digest,
+                               stats = src.stats)
+
+    if timestamp is not None and not (store is not None and 
+                                      os.stat(filename).st_nlink > 1):
+        os.utime(filename, (timestamp,)*2)
+    return key
+
+
+def _find_kernel_copy():
+    """
+    Returns copy(src_fd, offset, dst_fd, length), copying up to length
+    bytes at offset of src_fd to the position of dst_fd without going
+    through python, and returning how many were copied. Uses 
+    os.copy_file_range or os.sendfile when python has them, else the 
+    libc ones. Returns None when there's no such thing.
+    """
+    if hasattr(os, 'copy_file_range'):
+        return lambda src, offset, dst, length: os.copy_file_range(
+                                                    src, dst, length, offset)
+    if hasattr(os, 'sendfile'):
+        return lambda src, offset, dst, length: os.sendfile(
+                                                    dst, src, offset, length)
+    if not sys.platform.startswith('linux'):
+        return None     # Elsewhere, sendfile only writes to sockets
+
+    try:
+        import ctypes, ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+    except (ImportError, OSError):
+        return None
+
+    loff_p = ctypes.POINTER(ctypes.c_int64)
+    if hasattr(libc, 'copy_file_range'):
+        func = libc.copy_file_range
+        func.argtypes = [ctypes.c_int, loff_p, ctypes.c_int, loff_p,
+                         ctypes.c_size_t, ctypes.c_uint]
+        call = lambda src, off, dst, length: func(src, off, dst, None, 
+                                                  length, 0)
+    elif hasattr(libc, 'sendfile64'):
+        func = libc.sendfile64
+        func.argtypes = [ctypes.c_int, ctypes.c_int, loff_p, ctypes.c_size_t]
+        call = lambda src, off, dst, length: func(dst, src, off, length)
+    else:
+        return None
+    func.restype = ctypes.c_ssize_t
+
+    def copy(src, offset, dst, length):
+        offset = ctypes.c_int64(offset)
+        ret = call(src, ctypes.byref(offset), dst, length)
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return ret
+    return copy
+
+_kernel_copy = _find_kernel_copy()
+
+
+def _copy_physical(src, start, length, dst):
+    """
+    Copies the length bytes at start of the AppendedFiles src to the 
+    position of file dst inside the kernel, when they're stored as is
+    in a 2048 bytes/sector track, see AppendedFiles.physical_extent.
+
+    Returns whether it did. Otherwise dst might be partially written, 
+    but its position is left untouched.
+    """
+    extent = src.physical_extent(start, length) if length else None
+    if _kernel_copy is None or extent is None:
+        return False
+    track, offset = extent
+
+    dst.flush()
+    pos = dst.tell()
+    copied = 0
+    try:
+        while copied < length:
+            ret = _kernel_copy(track.fileno(), offset + copied, 
+                               dst.fileno(), length - copied)
+            if ret <= 0:
+                break   # Track shorter than the extent
+            copied += ret
+    except EnvironmentError:
+        pass    # Not supported by the kernel or the filesystems
+    dst.seek(pos + copied if copied == length else pos)
+    if copied == length and src.stats is not None:
+        src.stats.bytes_written += length
+        src.stats.kernel_bytes += length
+    return copied == length
+
+
+class ExtentFile(object):
+    """
+    Read-only, seekable file-like view of the ex_len bytes at sector 
+    ex_loc of src, see ISO9660.open. It keeps its own position and 
+    seeks src before every read, holding lock if any, so many handles
+    can share src. What's read is also fed to digest, unless it's None.
+    """
+    mode = 'rb'
+
+    def __init__(self, src, ex_loc, ex_len, name = '', lock = None, 
+                 digest = None):
+        self._src = src
+        self._start = ex_loc*2048
+        self._len = ex_len
+        self._pos = 0
+        self._lock = lock if lock is not None else threading.Lock()
+        self._digest = digest
+        self.name = name
+        self.closed = False
+        self.stats = getattr(src, 'stats', None)    # For ContentStore.add
+
+    def _check_closed(self):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+
+    def read(self, length = None):
+        self._check_closed()
+        left = max(0, self._len - self._pos)
+        if length is None or length < 0 or length > left:
+            length = left
+        with self._lock:
+            self._src.seek(self._start + self._pos)
+            data = self._src.read(length)
+        self._pos += len(data)
+        if self._digest:
+            self._digest.update(data)
+        return data
+
+    def seek(self, a, b = 0):
+        # Like file.seek, seeking past the end is allowed
+        self._check_closed()
+        if b == 0:
+            pos = a
+        elif b == 1:
+            pos = self._pos + a
+        elif b == 2:
+            pos = self._len + a
+        else:
+            raise ValueError('Invalid whence ({}, should be 0, 1 or 2)'
+                             .format(b))
+        if pos < 0:
+            raise IOError(errno.EINVAL, 'Invalid argument')
+        self._pos = pos
+
+    def tell(self):
+        self._check_closed()
+        return self._pos
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type=None, value=None, traceback=None):
+        self.close()
+
+
+def _plan_reads(records, gap = 64*1024, size = 4*1024*1024):
+    """
+    Groups records, sorted by ex_loc either way, in runs of files close
+    enough to be read at once: [(start, length, [records]), ...], start
+    & length in bytes, records in their order. A file joins the run 
+    before it when they're at most gap bytes apart and the run stays 
+    within size bytes, so with size 0 every file gets its own run.
+    """
+    runs = []
+    for rec in records:
+        start = rec['ex_loc']*2048
+        end = start + rec['ex_len']
+        if runs:
+            run = runs[-1]
+            if (start <= run[1] + gap and end + gap >= run[0] and
+                    max(run[1], end) - min(run[0], start) <= size):
+                run[0], run[1] = min(run[0], start), max(run[1], end)
+                run[2].append(rec)
+                continue
+        runs.append([start, end, [rec]])
+    return [(a, b - a, recs) for a, b, recs in runs]
+
+
+class _ReadAhead(object):
+    """
+    The length bytes at start of the AppendedFiles src, read at once.
+    It stands for src while the files they hold are dumped, see 
+    _plan_reads.
+    """
+    def __init__(self, src, start, length):
+        src.seek(start)
+        self._data = src.read(length)
+        self._start = start
+        self._pos = start
+        self.stats = src.stats
+
+    def seek(self, a, b = 0):
+        if b == 0:
+            self._pos = a
+        if b == 1:
+            self._pos += a
+        if b == 2:
+            self._pos = self._start + len(self._data) - a
+
+    def read(self, length = None):
+        pos = self._pos - self._start
+        if pos < 0:
+            raise ValueError('Reading before the data read ahead')
+        end = len(self._data) if length is None else pos + length
+        data = self._data[pos:end]
+        self._pos += len(data)
+        return data
+
+    def tell(self):
+        return self._pos
+
+    def physical_extent(self, start, length):
+        return None     # Already in memory
+
+
+class _Crc32(object):
+    # zlib.crc32 behind the hashlib interface
+    def __init__(self):
+        self._crc = 0
+
+    def update(self, data):
+        self._crc = zlib.crc32(data, self._crc)
+
+    def hexdigest(self):
+        return '{:08x}'.format(self._crc & 0xffffffff)
+
+
+def _new_hash(algorithm):
+    if algorithm == 'crc32':
+        return _Crc32()
+    return hashlib.new(algorithm)
+
+
+class _Digester(object):
+    """
+    Computes the digests of a file as its data is fed with update(), 
+    hexdigests() ends the file. With threaded, each algorithm runs in
+    its own thread so hashing overlaps with reading and writing; the
+    queues are bounded so readers can't get too far ahead.
+    """
+    def __init__(self, algorithms = HASH_ALGORITHMS, threaded = True, 
+                 queue_size = 8):
+        for i in algorithms:
+            if not i in HASH_ALGORITHMS:
+                raise ValueError('Unknown hash algorithm: {}'.format(i))
+        self.algorithms = tuple(algorithms)
+        self._threads = []
+        if threaded:
+            for i in self.algorithms:
+                todo, done = Queue.Queue(queue_size), Queue.Queue()
+                thread = threading.Thread(target = self._run, 
+                                          args = (i, todo, done))
+                thread.daemon = True
+                thread.start()
+                self._threads.append((thread, todo, done))
+        else:
+            self._hashes = [_new_hash(i) for i in self.algorithms]
+
+    @staticmethod
+    def _run(algorithm, todo, done):
+        # None ends the file, False the thread
+        h = _new_hash(algorithm)
+        while True:
+            data = todo.get()
+            if data is None:
+                done.put(h.hexdigest())
+                h = _new_hash(algorithm)
+            elif data is False:
+                return
+            else:
+                h.update(data)
+
+    def update(self, data):
+        if self._threads:
+            for thread, todo, done in self._threads:
+                todo.put(data)
+        else:
+            for h in self._hashes:
+                h.update(data)
+
+    def hexdigests(self):
+        """
+        Returns {algorithm: hexdigest} of the data fed since the last
+        call.
+        """
+        if self._threads:
+            for thread, todo, done in self._threads:
+                todo.put(None)
+            digests = [done.get() for thread, todo, done in self._threads]
+        else:
+            digests = [h.hexdigest() for h in self._hashes]
+            self._hashes = [_new_hash(i) for i in self.algorithms]
+        return dict(zip(self.algorithms, digests))
+
+    def close(self):
+        for thread, todo, done in self._threads:
+            todo.put(False)
+        for thread, todo, done in self._threads:
+            thread.join()
+        self._threads = []
+
+
+class _Checkpoint(object):
+    """
+    Files an extraction into target already dumped, saved in filename
+    one line per file as they're added, for dump_all_files to resume.
+    What was saved for another target is discarded.
+    """
+    def __init__(self, filename, target):
+        self._filename = filename
+        header = '# gditools checkpoint {}'.format(target)
+        self._done = set()
+        try:
+            with open(filename) as f:
+                lines = f.read().split('\n')
+        except IOError:
+            lines = []
+        if lines and lines[0] == header:
+            for i in lines[1:-1]:   # The last one can be incomplete
+                ex_loc, ex_len, name = i.split(' ', 2)
+                self._done.add((int(ex_loc), int(ex_len), name))
+
+        path = os.path.dirname(filename)
+        if path and not os.path.exists(path):
+            os.makedirs(path)
+        self._f = open(filename, 'w')
+        self._f.write(header + '\n')
+        for i in sorted(self._done):
+            self._write(i)
+
+    def _write(self, key):
+        self._f.write('{} {} {}\n'.format(*key))
+        self._f.flush()
+
+    def has(self, rec):
+        return (rec['ex_loc'], rec['ex_len'], rec['name']) in self._done
+
+    def add(self, rec):
+        key = (rec['ex_loc'], rec['ex_len'], rec['name'])
+        if not key in self._done:
+            self._done.add(key)
+            self._write(key)
+
+    def close(self, remove = False):
+        self._f.close()
+        if remove:
+            os.remove(self._filename)
+
+
+class ContentStore(object):
+    """
+    Folder keeping file contents once, whatever the images and paths
+    they come from, so extracting many images into it doesn't take the
+    space of their common files more than once, see dump_all_files.
+
+    Contents are stored as objects/<key[:2]>/<key[2:]>, their key being
+    the *algorithm* digest (md5 or sha1) computed while they're written.
+    Extracted files are links to them, *link* being:
+
+        'hard': Hardlinks
+        'reflink': Copy-on-write clones (Linux, on btrfs, XFS...)
+        'copy': Plain copies
+
+    Each falls back on the next ones when the filesystem can't do it.
+    Hardlinks share everything but their names: their timestamps are
+    those of the last extraction, and writing to one writes to all.
+
+    What each extraction target uses is kept in refs/, so gc() can
+    remove the objects no target uses anymore.
+    """
+    _LINKS = ['hard', 'reflink', 'copy']
+
+    def __init__(self, root, algorithm = 'sha1', link = 'hard'):
+        if not algorithm in ['md5', 'sha1']:
+            raise ValueError('Argument algorithm should be either '
+                             '\'md5\' or \'sha1\'')
+        if not link in self._LINKS:
+            raise ValueError('Argument link should be either \'hard\', '
+                             '\'reflink\' or \'copy\'')
+        self.root = os.path.abspath(root)
+        self.algorithm = algorithm
+        self.link = link
+        for i in ['objects', 'refs', 'tmp']:
+            _makedirs(os.path.join(self.root, i))
+
+    def path(self, key):
+        return os.path.join(self.root, 'objects', key[:2], key[2:])
+
+    def add(self, src, length, digest = None):
+        """
+        Stores the length bytes read from src and returns their key.
+        They're also fed to digest, unless it's None.
+        """
+        fd, tmp = tempfile.mkstemp(dir = os.path.join(self.root, 'tmp'))
+        key = _new_hash(self.algorithm)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                _copy_buffered(src, f, length = length, closeOut = False,
+                               digest = key if digest is None
+                                        else _Tee(key, digest),
+                               stats = getattr(src, 'stats', None))
+            key = key.hexdigest()
+            path = self.path(key)
+            if os.path.exists(path):
+                os.remove(tmp)
+            else:
+                _makedirs(os.path.dirname(path))
+                os.rename(tmp, path)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return key
+
+    def materialize(self, key, filename):
+        """
+        Makes filename a link to the object of key, see link.
+        """
+        path = self.path(key)
+        if os.path.lexists(filename):
+            os.remove(filename)
+        for link in self._LINKS[self._LINKS.index(self.link):]:
+            try:
+                if link == 'hard':
+                    os.link(path, filename)
+                elif link == 'reflink':
+                    _reflink(path, filename)
+                else:
+                    shutil.copyfile(path, filename)
+                return
+            except (EnvironmentError, AttributeError, ImportError):
+                # Can't, or no os.link/fcntl on this OS
+                if link == 'copy':
+                    raise
+                if os.path.lexists(filename):
+                    os.remove(filename)
+
+    def _ref_filename(self, target):
+        name = md5(os.path.realpath(target)).hexdigest()
+        return os.path.join(self.root, 'refs', name)
+
+    def _read_refs(self, filename):
+        # Returns (target, {name: key})
+        with open(filename) as f:
+            lines = f.read().split('\n')
+        keys = {}
+        for i in lines[1:]:
+            if i:
+                key, name = i.split(' ', 1)
+                keys[name] = key
+        return lines[0][2:], keys
+
+    def refs(self):
+        """
+        Returns {target: {name: key}} of all the extraction targets.
+        """
+        folder = os.path.join(self.root, 'refs')
+        return dict(self._read_refs(os.path.join(folder, i))
+                    for i in os.listdir(folder))
+
+    def add_refs(self, target, keys, names = None):
+        """
+        Records that the files of target use the objects of keys,
+        {name: key}. When names is given, the files recorded before
+        that aren't in it are forgotten.
+        """
+        filename = self._ref_filename(target)
+        refs = {}
+        if os.path.exists(filename):
+            refs = self._read_refs(filename)[1]
+        refs.update(keys)
+        if names is not None:
+            refs = dict((i, j) for i, j in refs.items() if i in names)
+
+        with open(filename + '.tmp', 'w') as f:
+            f.write('# {}\n'.format(os.path.realpath(target)))
+            for name in sorted(refs):
+                f.write('{} {}\n'.format(refs[name], name))
+        if os.path.exists(filename):    # os.rename won't on Windows
+            os.remove(filename)
+        os.rename(filename + '.tmp', filename)
+
+    def forget(self, target):
+        # The objects of target can go at the next gc
+        filename = self._ref_filename(target)
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    def gc(self, prune = True):
+        """
+        Removes the objects no target uses, and what interrupted
+        extractions left in tmp/. Returns how many objects were removed
+        and their size. Nothing should be extracted meanwhile.
+
+        prune: Forgets the targets that were deleted first
+        """
+        used = set()
+        for target, keys in self.refs().items():
+            if prune and not os.path.isdir(target):
+                self.forget(target)
+            else:
+                used.update(keys.values())
+
+        removed, size = 0, 0
+        objects = os.path.join(self.root, 'objects')
+        for prefix in os.listdir(objects):
+            for i in os.listdir(os.path.join(objects, prefix)):
+                if not prefix + i in used:
+                    path = os.path.join(objects, prefix, i)
+                    size += os.path.getsize(path)
+                    os.remove(path)
+                    removed += 1
+        tmp = os.path.join(self.root, 'tmp')
+        for i in os.listdir(tmp):
+            os.remove(os.path.join(tmp, i))
+        return removed, size
+
+
+class _Tee(object):
+    # Feeds what it's fed to all its digests
+    def __init__(self, *digests):
+        self._digests = digests
+
+    def update(self, data):
+        for i in self._digests:
+            i.update(data)
+
+
+def _reflink(src, dst):
+    # Copy-on-write clone of src, Linux only (FICLONE ioctl)
+    import fcntl
+    with open(src, 'rb') as f1:
+        with open(dst, 'wb') as f2:
+            fcntl.ioctl(f2.fileno(), 0x40049409, f1.fileno())
+
+
+def _makedirs(path):
+    # os.makedirs, fine if another process just made it
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+
+def _open_archive(filename):
+    """
+    Returns an archive writer for filename, its format being guessed from
+    the extension.
+    """
+    name = filename.lower()
+    if name.endswith('.zip'):
+        return _ZipWriter(filename)
+    for ext, mode in [('.tar', 'w'), ('.tar.gz', 'w:gz'), ('.tgz', 'w:gz'),
+                      ('.tar.bz2', 'w:bz2'), ('.tbz2', 'w:bz2')]:
+        if name.endswith(ext):
+            return _TarWriter(filename, mode)
+    raise ValueError('Unknown archive format: {}'.format(filename))
+
+
+class _TarWriter(object):
+    def __init__(self, filename, mode = 'w'):
+        self._tar = tarfile.open(filename, mode)
+
+    def add_dir(self, name, mtime):
+        info = tarfile.TarInfo(name)
+        info.type = tarfile.DIRTYPE
+        info.mode = 0755
+        info.mtime = int(mtime)
+        self._tar.addfile(info)
+
+    def add_file(self, name, fileobj, size, mtime):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mode = 0644
+        info.mtime = int(mtime)
+        self._tar.addfile(info, fileobj)   # Copies 16 KiB at a time
+
+    def close(self):
+        self._tar.close()
+
+
+class _ZipWriter(object):
+    """
+    zipfile can only stream files from the filesystem, add_file does 
+    what ZipFile.write does but reading from a file-like object.
+    """
+    def __init__(self, filename):
+        self._zip = zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED,
+                                    allowZip64 = True)
+
+    def _zipinfo(self, name, mtime):
+        # Zip archives can't store dates before 1980
+        date_time = max(time.localtime(mtime)[:6], (1980, 1, 1, 0, 0, 0))
+        return zipfile.ZipInfo(name, date_time)
+
+    def add_dir(self, name, mtime):
+        zinfo = self._zipinfo(name + '/', mtime)
+        zinfo.external_attr = (040755 << 16) | 0x10  # MS-DOS directory flag
+        self._zip.writestr(zinfo, '')
+
+    def add_file(self, name, fileobj, size, mtime, bufsize = 1*1024*1024):
+        zf = self._zip
+        zinfo = self._zipinfo(name, mtime)
+        zinfo.external_attr = 0100644 << 16
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        zinfo.file_size = size
+        zinfo.header_offset = zf.fp.tell()
+        zf._writecheck(zinfo)
+        zf._didModify = True
+
+        # CRC and compressed size are only known once it's all written,
+        # the header is written again with them at the end.
+        zip64 = size * 1.05 > zipfile.ZIP64_LIMIT
+        zinfo.CRC = crc = 0
+        zinfo.compress_size = compress_size = 0
+        zf.fp.write(zinfo.FileHeader(zip64))
+        cmpr = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        while True:
+            buf = fileobj.read(bufsize)
+            if not buf:
+                break
+            crc = zlib.crc32(buf, crc) & 0xffffffff
+            buf = cmpr.compress(buf)
+            compress_size += len(buf)
+            zf.fp.write(buf)
+        buf = cmpr.flush()
+        compress_size += len(buf)
+        zf.fp.write(buf)
+
+        zinfo.CRC = crc
+        zinfo.compress_size = compress_size
+        position = zf.fp.tell()
+        zf.fp.seek(zinfo.header_offset, 0)
+        zf.fp.write(zinfo.FileHeader(zip64))
+        zf.fp.seek(position, 0)
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+
+    def close(self):
+        self._zip.close()
+
+
+# Each extraction worker (thread or process) gets its own track handles.
+# They're opened by the first job so errors reach the caller, a failing 
+# pool initializer would only get respawned over and over.
+_worker_state = threading.local()
+
+def _init_dump_worker(dict1, dict2 = None, stats = False):
+    _worker_state.dicts = dict1, dict2
+    _worker_state.gdifile = None
+    _worker_state.stats = IOStats() if stats else None
+
+def _dump_extent_job(job):
+    # Workers already run in parallel, they hash in their own thread.
+    # A job is a run of _plan_reads, its files are read at once.
+    if _worker_state.gdifile is None:
+        _worker_state.gdifile = AppendedFiles(*_worker_state.dicts, 
+                                              stats = _worker_state.stats)
+    start, length, files, algorithms, store = job
+    src = _worker_state.gdifile
+    if len(files) > 1:
+        src = _ReadAhead(src, start, length)
+    results = []
+    for ex_loc, ex_len, filename, timestamp in files:
+        digest = _Digester(algorithms, threaded = False) if algorithms else None
+        key = _dump_extent(src, ex_loc, ex_len, filename, timestamp, digest, 
+                           store)
+        results.append((filename, digest.hexdigests() if digest else None,
+                        key))
+    # The counters of this job only, the caller adds them up
+    stats = _worker_state.stats.pop() if _worker_state.stats else None
+    return results, stats
+
+
 def UpdateLine(text):
     """
     Allows to print successive messages over the last line. Line is 
@@ -740,20 +3153,40 @@ def UpdateLine(text):
     sys.stdout.flush()
 
 
-def _copy_buffered(f1, f2, length = None, bufsize = 1*1024*1024, closeOut = True):
+def _copy_buffered(f1, f2, length = None, bufsize = 1*1024*1024, closeOut = True,
+                   digest = None, stats = None):
     """
-    Copy istream f1 into ostream f2 in bufsize chunks
+    Copy istream f1 into ostream f2 in bufsize chunks, returns the 
+    number of bytes copied, fewer than length if f1 ends before. Every
+    chunk is also fed to digest unless it's None, and f2 can be None to
+    only compute digests. What's written is counted by stats, an 
+    IOStats, unless it's None.
+
+    With a CdImage as f1, a bufsize multiple of 2048 makes every chunk
+    a batch of whole sectors.
     """
+    if bufsize < 1:
+        raise ValueError('Argument bufsize should be at least 1')
     if length is None:  # By default it reads all the file
         tmp = f1.tell()
         f1.seek(0,2)
         length = f1.tell()
         f1.seek(tmp,0)
-    f2.seek(0,0)
-
-    for i in xrange(length/bufsize):
-        f2.write(f1.read(bufsize))
-    f2.write(f1.read(length % bufsize))
+    if f2 is not None:
+        f2.seek(0,0)
+
+    copied = 0
+    while copied < length:
+        data = f1.read(min(bufsize, length - copied))
+        if not data:
+            break
+        copied += len(data)
+        if f2 is not None:
+            f2.write(data)
+            if stats is not None:
+                stats.bytes_written += len(data)
+        if digest is not None:
+            digest.update(data)
 
     #while length:
     #    chunk = min(length, bufsize)
@@ -761,23 +3194,57 @@ def _copy_buffered(f1, f2, length = None, bufsize = 1*1024*1024, closeOut = True
     #    data = f1.read(chunk)
     #    f2.write(data)
 
-    if closeOut:
+    if closeOut and f2 is not None:
         f2.close()
+    return copied
+
+
+def _throughput(nbytes, seconds):
+    """
+    Returns a short report of how fast nbytes were processed.
+    """
+    mib = nbytes / 1024. / 1024.
+    rate = mib / seconds if seconds > 0 else float('inf')
+    return '{:.1f} MiB in {:.2f} s ({:.1f} MiB/s)'.format(mib, seconds, rate)
 
 
 def _printUsage(pname='gditools.py'):
     print('Usage: {} -i input_gdi [options]\n'.format(pname))
     print('  -h, --help             Display this help')
     print('  -l, --list             List all files in the filesystem and exit')
+    print('  --list-format [format] Same, one row per record with its extent,')
+    print('                           flags, date and track: jsonl or csv')
     print('  -o [outdir]            Output directory. Default: gdi folder')
     print('  -s [filename]          Create a sorttxt file with custom name')
     print('                           (It uses *data-folder* as prefix)')
     print('  -b [ipname]            Dump the ip.bin with custom name')
     print('  -e [filename]          Dump a single file from the filesystem')
     print('  --extract-all          Dump all the files in the *data-folder*')
+    print('  --archive [filename]   Dump all the files into a .tar, .tar.gz, .tgz,')
+    print('                           .tar.bz2, .tbz2 or .zip archive instead')
     print('  --data-folder [name]   *data-folder* subfolder. Default: data')
     print(' '*27 + '(__volume_label__ --> Use ISO9660 volume label)')
+    print('  --hash-manifest [filename]')
+    print('                         Write the CRC32, MD5 and SHA-1 of all files,')
+    print('                           hashed while they are extracted if any')
     print('  --sort-spacer [num]    Sorttxt entries are sperated by num')
+    print('  --jobs [num]           Extract all files with num workers. Default: 1')
+    print('  --executor [kind]      Workers kind: process or thread. Default: process')
+    print('  --cache                Keep the parsed filesystem next to the gdi')
+    print('  --cache-dir [dir]      Same as --cache, but keep it in dir')
+    print('  --incremental          Skip the files already extracted, same size')
+    print('                           and timestamp')
+    print('  --incremental-hash [algorithm]')
+    print('                         Same, also comparing crc32, md5 or sha1 digests')
+    print('  --checkpoint [filename]')
+    print('                         Record extracted files, to resume from there')
+    print('  --store [dir]          Extract file contents once in a shared store,')
+    print('                           files being hardlinks to them, which')
+    print('                           keep the dates of the store')
+    print('  --coalesce-gap [KiB]   Extract all files at most KiB apart with a')
+    print('                           single read. Default: 64')
+    print('  --no-coalesce          Read every extracted file on its own')
+    print('  --stats                Report seeks, reads, writes and time spent')
     print('  --silent               Minimal verbosity mode')
     print('  [no option]            Display gdi infos if not silent')
     print('\n')
@@ -800,12 +3267,29 @@ def main(argv):
     silent = False
     datafolder = 'data'
     listFiles = False
+    listFormat = ''
     sort_spacer = 1
+    jobs = 1
+    executor = 'process'
+    cache = False
+    cache_dir = None
+    archive = ''
+    manifest = ''
+    stats = False
+    incremental = False
+    checkpoint = None
+    store = None
+    coalesce = {}
     try:
         opts, args = getopt.getopt(argv,"hli:o:s:b:e:",
                                    ['help','silent', 'list',
                                     'extract-all','data-folder=',
-                                    'sort-spacer='])
+                                    'sort-spacer=', 'jobs=', 'executor=',
+                                    'cache', 'cache-dir=', 'archive=',
+                                    'hash-manifest=', 'stats', 'incremental',
+                                    'incremental-hash=', 'checkpoint=',
+                                    'store=', 'coalesce-gap=', 
+                                    'no-coalesce', 'list-format='])
 
     except getopt.GetoptError:
         _printUsage(progname)
@@ -850,12 +3334,61 @@ def main(argv):
             datafolder = arg
         elif opt == '--sort-spacer':
             sort_spacer = arg
+        elif opt == '--jobs':
+            jobs = int(arg)
+        elif opt == '--executor':
+            executor = arg
+        elif opt == '--cache':
+            cache = True
+        elif opt == '--cache-dir':
+            cache_dir = arg
+        elif opt == '--archive':
+            archive = arg
+            extract = '__all__'
+        elif opt == '--hash-manifest':
+            manifest = arg
+        elif opt == '--stats':
+            stats = True
+        elif opt == '--incremental':
+            incremental = incremental or True
+        elif opt == '--incremental-hash':
+            incremental = arg
+        elif opt == '--checkpoint':
+            checkpoint = arg
+        elif opt == '--store':
+            store = arg
+        elif opt == '--list-format':
+            if not arg in LISTING_FORMATS:
+                _printUsage(progname)
+                sys.exit(2)
+            listFormat = arg
+        elif opt == '--coalesce-gap':
+            coalesce['coalesce_gap'] = int(arg)*1024
+        elif opt == '--no-coalesce':
+            coalesce['coalesce_size'] = 0
 
     
-    with GDIfile(inputfile, verbose = not silent) as gdi:
+    # Machine-readable listings get stdout for themselves
+    with GDIfile(inputfile, verbose = not (silent or listFormat), 
+                 cache = cache, cache_dir = cache_dir, stats = stats) as gdi:
+        if listFormat:
+            try:
+                gdi.print_listing(listFormat)
+            except IOError as e:
+                if e.errno != errno.EPIPE:
+                    raise
+                sys.exit()  # Whatever reads it is done, e.g. head
+            if stats:
+                sys.stderr.write('\nI/O statistics:\n\n')
+                sys.stderr.write('\n'.join(gdi._stats.report()) + '\n')
+            sys.exit()
+
         if listFiles:
             print('Listing all files in the filesystem:\n')
             gdi.print_files()
+            if stats:
+                print('\nI/O statistics:\n')
+                gdi.print_io_stats()
             sys.exit()
          
         if outputpath:
@@ -882,10 +3415,23 @@ def main(argv):
         if extract:
             if extract.lower() in ['__all__']:
                 if not silent: print('\nDumping all files:')
-                gdi.dump_all_files(target=datafolder)
+                gdi.dump_all_files(target=datafolder, workers=jobs,
+                                   executor=executor, archive=archive,
+                                   manifest=manifest or None,
+                                   incremental=incremental,
+                                   checkpoint=checkpoint, store=store,
+                                   **coalesce)
             else:
                 gdi.dump_file(extract, target=gdi._dirname)
 
+        if manifest and not extract.lower() in ['__all__']:
+            if not silent: print('\nHashing all files:')
+            gdi.hash_all_files(manifest=manifest)
+
+        if stats:
+            print('\nI/O statistics:\n')
+            gdi.print_io_stats()
+
         
 if __name__ == '__main__':
     if len(sys.argv) > 1: